@@ -0,0 +1,179 @@
+"""
+Playing cached GIFs as a uasyncio task, so other tasks keep running while
+the animation plays
+"""
+import utime
+from gc import collect
+import gifviewer
+from gifviewer import SCHEDULE_DROP
+from gifviewer import FrameScheduler
+from gifviewer import FrameDecoder
+from gifviewer import create_gif_image_files
+from gifviewer import display_screen
+from gifviewer import make_frame_cache
+from gifviewer import merge_region
+from gifcodec import SHOW_ALL
+from gifcodec import SHOW_NOTHING
+from gifcache import CACHE_READY
+from gifcache import prepare_cache
+from gifcache import open_cache
+
+
+def _asyncio():
+    try:
+        import uasyncio as asyncio
+    except ImportError:
+        # CPython
+        import asyncio
+    return asyncio
+
+
+# longest AsyncPlayer decodes for before letting other tasks run, in ms
+DEFAULT_TIME_SLICE_MS = 20
+
+
+class AsyncPlayer:
+    """
+    Plays cached GIFs as a uasyncio task (asyncio under CPython) instead of
+    blocking like show_gif_frames: frame deadlines are awaited, and a frame
+    that takes longer than time_slice_ms to decode yields part way through,
+    so other tasks keep running while the animation plays.
+
+        player = AsyncPlayer('fuzzy')
+        player.start()          # from inside the event loop
+        ...
+        player.swap('other')    # at the next frame
+        player.stop()
+
+    The display is only sent to between frames.  A GIF without a cache has
+    it built on the spot, which blocks until it is done.
+    """
+
+    def __init__(self, image_name, frame_cache_budget=None, schedule_policy=SCHEDULE_DROP,
+                 time_slice_ms=DEFAULT_TIME_SLICE_MS, flash_budget=None):
+        """
+        :param frame_cache_budget: see run()
+        :param schedule_policy: see run()
+        :param time_slice_ms: longest to decode for without yielding
+        :param flash_budget: see run()
+        """
+        if gifviewer._oled is None:
+            gifviewer.init_display()
+        self.frame_cache_budget = frame_cache_budget
+        self.caches = None
+        if flash_budget is not None:
+            from cachemanager import CacheManager
+            self.caches = CacheManager(flash_budget)
+        self.time_slice_ms = time_slice_ms
+        self.scheduler = FrameScheduler(schedule_policy)
+        self.image_name = None
+        self.next_image = image_name
+        self.decoder = None
+        self.task = None
+        self.running = False
+
+    def start(self):
+        """
+            Start playing in a new task, needs a running event loop
+        :return: the task
+        """
+        if self.task is None:
+            self.running = True
+            self.task = _asyncio().create_task(self.play())
+        return self.task
+
+    def stop(self):
+        """
+            Stop playing, the display keeps the last frame shown
+        """
+        self.running = False
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def swap(self, image_name):
+        """
+            Play another GIF, from the next frame on
+        """
+        self.next_image = image_name
+
+    def load(self, image_name):
+        cache_dir = "_".join(('cache', image_name))
+        # let the previous GIF's frames go first
+        if self.decoder is not None:
+            self.decoder.pack.close()
+            self.decoder = None
+        collect()
+        status, manifest = prepare_cache(cache_dir, image_name)
+        if status != CACHE_READY:
+            if self.caches is not None and not self.caches.make_room(image_name):
+                raise OSError("not enough flash for the frame cache of %s" % image_name)
+            create_gif_image_files(cache_dir, image_name, manifest=manifest)
+            collect()
+        if self.caches is not None:
+            self.caches.play(image_name)
+        oled = gifviewer._oled
+        self.decoder = FrameDecoder(open_cache(cache_dir, image_name), display_screen(oled), oled.framebuf,
+                                    make_frame_cache(self.frame_cache_budget))
+        self.image_name = image_name
+        # the new GIF starts now, not when the old one's frame was due
+        self.scheduler.deadline = None
+
+    async def play(self):
+        """
+            The player task: show frames until stop()
+        """
+        asyncio = _asyncio()
+        sleep_ms = getattr(asyncio, 'sleep_ms', None)
+        scheduler = self.scheduler
+        time_slice_ms = self.time_slice_ms
+        pending = SHOW_NOTHING
+        reported_misses = 0
+        while self.running:
+            if self.next_image is not None:
+                image_name = self.next_image
+                self.next_image = None
+                self.load(image_name)
+                pending = SHOW_NOTHING
+                reported_misses = 0
+            decoder = self.decoder
+            frame_cache = decoder.frame_cache
+
+            slice_start = utime.ticks_ms()
+            codec = decoder.read()
+            if codec is None:
+                decoder.draw_cached()
+            else:
+                for _ in codec.steps(decoder.reader, decoder.screen, decoder.fb, decoder.segments):
+                    if utime.ticks_diff(utime.ticks_ms(), slice_start) >= time_slice_ms:
+                        await asyncio.sleep(0)
+                        slice_start = utime.ticks_ms()
+                decoder.drawn(codec)
+            changed = decoder.changed
+            if decoder.index == 1 and decoder.looped:
+                scheduler.report()
+                if frame_cache is not None and frame_cache.misses != reported_misses:
+                    frame_cache.report()
+                    reported_misses = frame_cache.misses
+
+            if pending is not SHOW_NOTHING:
+                changed = merge_region(pending, changed)
+
+            ahead = scheduler.ahead(decoder.delay)
+            if ahead > 0:
+                if sleep_ms is not None:
+                    await sleep_ms(ahead)
+                else:
+                    await asyncio.sleep(ahead / 1000)
+            else:
+                # other tasks still get a turn every frame
+                await asyncio.sleep(0)
+            if ahead < 0:
+                pending = changed if changed is SHOW_ALL else tuple(changed)
+                continue
+            pending = SHOW_NOTHING
+
+            if changed is SHOW_ALL:
+                gifviewer._oled.show()
+            elif changed is not SHOW_NOTHING:
+                gifviewer._oled.show(changed)
@@ -0,0 +1,89 @@
+"""
+Decoding the next frame on a second thread while the current one is shown,
+only needed for run(..., background_decode=True)
+"""
+from gifcodec import DISPLAY_BUFFER_SIZE
+from gifcodec import DISPLAY_WIDTH
+from gifcodec import DISPLAY_HEIGHT
+from gifcodec import SHOW_ALL
+from gifcodec import SHOW_NOTHING
+from gifviewer import FrameDecoder
+
+
+class BackgroundDecoder:
+    """
+    FrameDecoder on a second thread, drawing the next frame into a buffer
+    of its own while the current one is waited for and sent to the display
+
+    next() hands over a frame by copying that buffer into the display
+    buffer, then lets the worker start on the frame after it.  The worker
+    keeps drawing on top of its own buffer, so deltas still apply in order.
+    Frame time becomes roughly the longer of decode and show instead of
+    their sum, as far as the show() I2C transfer and sleeps let the worker
+    run.
+    """
+
+    def __init__(self, pack, screen, frame_cache=None):
+        import _thread
+        import framebuf
+        self.screen = screen
+        back = bytearray(DISPLAY_BUFFER_SIZE)
+        # the first frame is drawn over what the display holds
+        back[:] = screen
+        self.decoder = FrameDecoder(pack, back, framebuf.FrameBuffer1(back, DISPLAY_WIDTH, DISPLAY_HEIGHT), frame_cache)
+        # held while the worker has no frame to decode
+        self.wanted = _thread.allocate_lock()
+        self.wanted.acquire()
+        # held while no decoded frame is waiting for next()
+        self.done = _thread.allocate_lock()
+        self.done.acquire()
+        self.delay = 0
+        self.changed = SHOW_NOTHING
+        self.error = None
+        self.running = True
+        # of the frame next() returned last, the worker is already past it
+        self.index = 0
+        self.looped = False
+        _thread.start_new_thread(self.work, ())
+        self.wanted.release()
+
+    def work(self):
+        decoder = self.decoder
+        while True:
+            self.wanted.acquire()
+            if not self.running:
+                return
+            try:
+                delay, changed = decoder.next()
+                # the region list is reused for the frame after
+                self.changed = changed if changed is SHOW_ALL or changed is SHOW_NOTHING else tuple(changed)
+                self.delay = delay
+            except Exception as e:
+                self.error = e
+                self.running = False
+            self.done.release()
+            if not self.running:
+                return
+
+    def next(self):
+        """
+            Wait for the worker's frame and put it in the display buffer
+        :return: (delay, changed) like FrameDecoder.next()
+        """
+        self.done.acquire()
+        if self.error is not None:
+            raise self.error
+        decoder = self.decoder
+        self.screen[:] = decoder.screen
+        self.index = decoder.index
+        self.looped = decoder.looped
+        delay = self.delay
+        changed = self.changed
+        self.wanted.release()
+        return delay, changed
+
+    def stop(self):
+        self.running = False
+        # wake the worker up when it is waiting for a frame to decode
+        if self.wanted.locked():
+            self.wanted.release()
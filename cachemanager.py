@@ -0,0 +1,196 @@
+"""
+Keeps the frame caches of many GIFs within the flash they may use, only
+needed when run() is given a flash budget
+"""
+import os
+import json
+import stat
+from gipyf import GiPyF
+from gifcache import FRAME_HEADER_SIZE
+from gifcache import PACK_HEADER_SIZE
+from gifcache import clear_cache
+from gifcodec import DISPLAY_BUFFER_SIZE
+from gifcodec import DISPLAY_WIDTH
+from gifcodec import DELTA_SPAN_HEADER_SIZE
+
+
+def build_size(image_name):
+    """
+        Flash a build of image_name.gif may need at its peak, by the frame
+        rectangles: frame 1 as pages, every later frame at most a delta of
+        the display bytes its rectangle covers, which the default codecs
+        never exceed.  Twice that, as the loose frame files are only removed
+        once they have been packed.
+    :return: bytes
+    """
+    sizes = [0]
+
+    def add_frame(frame_number, top_left_x, top_left_y, width, height):
+        if frame_number == 1:
+            size = DISPLAY_BUFFER_SIZE
+        else:
+            # one span per display page the rectangle crosses
+            pages = ((top_left_x + width - 1) >> 3) - (top_left_x >> 3) + 1
+            size = min(DISPLAY_BUFFER_SIZE, pages * (min(height, DISPLAY_WIDTH) + DELTA_SPAN_HEADER_SIZE))
+        sizes[0] += FRAME_HEADER_SIZE + size
+
+    gif = GiPyF()
+    f = open("%s.gif" % image_name, "rb")
+    try:
+        # seeks past every frame's image data, nothing is decoded
+        gif.parse(f, None, lambda color_alpha_index, play_delay: None, skip_frames=0xffffffff,
+                  skip_callback=add_frame)
+    finally:
+        f.close()
+    # the loop frame, the map, the pack's header and index and the manifest
+    extra = (FRAME_HEADER_SIZE + DISPLAY_BUFFER_SIZE + DELTA_SPAN_HEADER_SIZE + PACK_HEADER_SIZE +
+             8 * (gif.frames_count + 2) + 256)
+    return 2 * (sizes[0] + extra)
+
+
+# last played order of the caches, in the working directory next to them
+CACHE_INDEX_FILE = 'caches.json'
+
+
+class CacheManager:
+    """
+    Keeps the cache_<image_name> directories within a flash budget
+
+    Every run() counts as a play of its GIF.  The play order is a counter
+    kept in CACHE_INDEX_FILE, so it does not need a real time clock.  Before
+    a build, the caches played longest ago are removed until the build fits
+    both the budget and the free space of the filesystem.
+    """
+
+    def __init__(self, budget=None):
+        """
+        :param budget: bytes all caches together may use, None for no limit
+            besides the free space
+        """
+        self.budget = budget
+        try:
+            f = open(CACHE_INDEX_FILE, "r")
+            try:
+                index = json.load(f)
+            finally:
+                f.close()
+        except (OSError, ValueError):
+            index = {}
+        self.clock = index.get("clock", 0)
+        # image name -> clock when last played
+        self.played = index.get("played", {})
+        self.evictions = 0
+        try:
+            self.block = os.statvfs(".")[0]
+        except (AttributeError, OSError):
+            self.block = 1
+
+    def save(self):
+        f = open(CACHE_INDEX_FILE, "w")
+        json.dump({"clock": self.clock, "played": self.played}, f)
+        f.close()
+
+    def play(self, image_name):
+        """
+            Record image_name as the one played last
+        """
+        self.clock += 1
+        self.played[image_name] = self.clock
+        self.save()
+
+    def size(self, cache_dir):
+        """
+        :return: bytes the directory's files take, rounded up to whole blocks
+        """
+        block = self.block
+        total = 0
+        for name in os.listdir(cache_dir):
+            total += (os.stat("/".join((cache_dir, name)))[6] + block - 1) // block * block
+        return total
+
+    def caches(self):
+        """
+        :return: list of [image name, bytes, last played], least recently
+            played first
+        """
+        result = []
+        for name in os.listdir():
+            if not name.startswith("cache_"):
+                continue
+            try:
+                if not stat.S_ISDIR(os.stat(name)[0]):
+                    continue
+                size = self.size(name)
+            except OSError:
+                continue
+            image_name = name[6:]
+            result.append([image_name, size, self.played.get(image_name, 0)])
+        result.sort(key=lambda cache: cache[2])
+        return result
+
+    def free(self):
+        """
+        :return: bytes free on the filesystem, None when it cannot tell
+        """
+        try:
+            info = os.statvfs(".")
+        except (AttributeError, OSError):
+            return None
+        return info[1] * info[4]
+
+    def evict(self, image_name):
+        cache_dir = "_".join(("cache", image_name))
+        clear_cache(cache_dir)
+        os.rmdir(cache_dir)
+        self.played.pop(image_name, None)
+        self.evictions += 1
+        print("removed frame cache:", cache_dir)
+
+    def make_room(self, image_name, needed=None):
+        """
+            Remove the caches played longest ago, other than image_name's,
+            until building image_name's fits.  Nothing is removed when
+            removing every other cache would still not be enough.
+        :param needed: bytes the build needs, build_size() by default
+        :return: True when it fits
+        """
+        if needed is None:
+            needed = build_size(image_name)
+        caches = self.caches()
+        used = 0
+        for cache in caches:
+            if cache[0] == image_name:
+                # what an interrupted build already wrote is reused
+                needed -= cache[1]
+            else:
+                used += cache[1]
+        # bytes to free, each byte of a cache removed counts for both limits
+        short = 0
+        if self.budget is not None:
+            short = used + needed - self.budget
+        free = self.free()
+        if free is not None and needed - free > short:
+            short = needed - free
+        if short <= 0:
+            return True
+        if short > used:
+            return False
+        for image, size, played in caches:
+            if image == image_name:
+                continue
+            self.evict(image)
+            short -= size
+            if short <= 0:
+                break
+        self.save()
+        return True
+
+    def report(self):
+        caches = self.caches()
+        for image_name, size, played in caches:
+            print("cache_%s: %d bytes, last played %d" % (image_name, size, played))
+        free = self.free()
+        print("flash caches: %d caches, %d bytes of %s, %s bytes free, %d evictions" % (
+            len(caches), sum(cache[1] for cache in caches),
+            "no budget" if self.budget is None else self.budget,
+            "?" if free is None else free, self.evictions))
@@ -0,0 +1,435 @@
+"""
+The frame cache on flash: the frame record format, the files a build
+writes into cache_<image_name>, packing them into one file for playback
+and the manifest telling whether they are up to date
+"""
+import os
+import json
+import struct
+import stat
+
+# Frame cache file layout, all little endian:
+#   magic 'GV', version, encoding, delay (1/100th second), width, height,
+#   top left x, top left y, payload length, then the payload itself
+CACHE_VERSION = 1
+FRAME_MAGIC = b'GV'
+FRAME_HEADER_FORMAT = '<2sBBHHHHHI'
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FORMAT)
+
+# A built cache is packed into one <image_name>.pack file: a header (magic
+# 'GVPK', version, frame count, segment count, index offset), the frame
+# records as above, then the loop frame, the .map JSON and the segment JSON
+# files, and last an index of (offset, length) pairs in that order, the
+# loop frame's length 0 when there is none
+PACK_MAGIC = b'GVPK'
+PACK_VERSION = 1
+PACK_HEADER_FORMAT = '<4sBBHHI'
+PACK_HEADER_SIZE = struct.calcsize(PACK_HEADER_FORMAT)
+
+# <image_name>.manifest is JSON: the CACHE_VERSION and PACK_VERSION the cache
+# was built with, the GIF's size, mtime and SHA-256, the frames written so
+# far, and whether the build is complete.  It is written before the first
+# frame and after every frame, and marked complete once the pack is written.
+# what cache_status() found
+CACHE_MISSING = 0
+CACHE_READY = 1
+# an interrupted build of the same GIF, it carries on from the manifest's frames
+CACHE_PARTIAL = 2
+# built from another GIF or by another version, it is cleared and rebuilt
+CACHE_STALE = 3
+
+
+def frame_file_name(cache_dir, image_name, frame_number):
+    return "%s_%d.bin" % ("/".join((cache_dir, image_name)), frame_number)
+
+
+def loop_file_name(cache_dir, image_name):
+    # delta from the last frame back to the first, played instead of frame 1 when looping
+    return "%s_loop.bin" % "/".join((cache_dir, image_name))
+
+
+def map_file_name(cache_dir, image_name):
+    return "%s.map" % "/".join((cache_dir, image_name))
+
+
+def segment_file_name(cache_dir, image_name, segment):
+    return "%s_segment_%d.map" % ("/".join((cache_dir, image_name)), segment)
+
+
+def pack_file_name(cache_dir, image_name):
+    return "%s.pack" % "/".join((cache_dir, image_name))
+
+
+def manifest_file_name(cache_dir, image_name):
+    return "%s.manifest" % "/".join((cache_dir, image_name))
+
+
+def write_frame(f, delay, width, height, top_left_x, top_left_y, encoding, payload):
+    f.write(struct.pack(FRAME_HEADER_FORMAT, FRAME_MAGIC, CACHE_VERSION, encoding, delay,
+                        width, height, top_left_x, top_left_y, len(payload)))
+    f.write(payload)
+
+
+def is_json_frame_file(file_name):
+    f = open(file_name, "rb")
+    first = f.read(1)
+    f.close()
+    return first == b'['
+
+
+def convert_json_cache(cache_dir, image_name):
+    """
+        Rewrite a cache directory written by the JSON frame format in place
+    :return: number of frames converted
+    """
+    # only caches from before the binary frame format need these
+    from gifcodec import ENCODING_MAP
+    from gifcodec import pack_image_data
+    converted = 0
+    frame_number = 1
+    while True:
+        file_name = frame_file_name(cache_dir, image_name, frame_number)
+        try:
+            os.stat(file_name)
+        except OSError:
+            break
+        if is_json_frame_file(file_name):
+            f = open(file_name, "r")
+            play_delay, width, height, top_left_x, top_left_y, image_data = json.load(f)
+            f.close()
+            delay = play_delay[0] | (play_delay[1] << 8) if play_delay else 0
+            tmp_file_name = file_name + ".tmp"
+            f = open(tmp_file_name, "wb")
+            write_frame(f, delay, width, height, top_left_x, top_left_y, ENCODING_MAP, pack_image_data(image_data))
+            f.close()
+            os.remove(file_name)
+            os.rename(tmp_file_name, file_name)
+            converted += 1
+        frame_number += 1
+    return converted
+
+
+def pack_cache(cache_dir, image_name):
+    """
+        Pack a cache's frame, loop, map and segment files into one file and
+        remove them.  The pack only gets its name once it is complete.
+    :return: number of frames
+    """
+    names = []
+    while True:
+        file_name = frame_file_name(cache_dir, image_name, len(names) + 1)
+        try:
+            os.stat(file_name)
+        except OSError:
+            break
+        names.append(file_name)
+    frames = len(names)
+    loop_name = loop_file_name(cache_dir, image_name)
+    try:
+        os.stat(loop_name)
+        names.append(loop_name)
+    except OSError:
+        names.append(None)
+    map_name = map_file_name(cache_dir, image_name)
+    image_map = load_gif_image_map(cache_dir, image_name)
+    if image_map is None:
+        raise ValueError("%s is not a complete cache" % cache_dir)
+    names.append(map_name)
+    segments = image_map.get("segments", 0) if isinstance(image_map, dict) else 0
+    image_map = None
+    for segment in range(segments):
+        names.append(segment_file_name(cache_dir, image_name, segment))
+
+    pack_name = pack_file_name(cache_dir, image_name)
+    tmp_pack_name = pack_name + ".tmp"
+    buffer = bytearray(512)
+    view = memoryview(buffer)
+    index = bytearray()
+    f = open(tmp_pack_name, "wb")
+    f.write(bytes(PACK_HEADER_SIZE))
+    offset = PACK_HEADER_SIZE
+    for file_name in names:
+        length = 0
+        if file_name is not None:
+            source = open(file_name, "rb")
+            while True:
+                count = source.readinto(buffer)
+                if not count:
+                    break
+                f.write(view[:count])
+                length += count
+            source.close()
+        index.extend(struct.pack('<II', offset, length))
+        offset += length
+    f.write(index)
+    f.seek(0)
+    f.write(struct.pack(PACK_HEADER_FORMAT, PACK_MAGIC, PACK_VERSION, 0, frames, segments, offset))
+    f.close()
+    os.rename(tmp_pack_name, pack_name)
+    remove_loose_files(cache_dir, image_name)
+    return frames
+
+
+def remove_loose_files(cache_dir, image_name):
+    """
+        Remove every file of a packed cache besides the pack and the
+        manifest, also what a pack_cache() interrupted after the rename left
+    :return: number of files removed
+    """
+    keep = (image_name + ".pack", image_name + ".manifest")
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name not in keep:
+            os.remove("/".join((cache_dir, name)))
+            removed += 1
+    return removed
+
+
+class FramePack:
+    """
+    A packed cache, read through one file handle that stays open: reading
+    a frame is a seek and the FrameReader's reads
+    """
+
+    def __init__(self, file_name):
+        f = open(file_name, "rb")
+        magic, version, reserved, frames, segments, index_offset = struct.unpack(
+            PACK_HEADER_FORMAT, f.read(PACK_HEADER_SIZE))
+        if magic != PACK_MAGIC:
+            f.close()
+            raise ValueError("not a frame cache pack")
+        if version != PACK_VERSION:
+            f.close()
+            raise ValueError("unsupported frame cache pack version %d" % version)
+        self.f = f
+        self.frame_count = frames
+        self.segments = segments
+        f.seek(index_offset)
+        count = frames + 2 + segments
+        # offset, length, offset, length, ...
+        self.index = struct.unpack('<%dI' % (2 * count), f.read(8 * count))
+        self.has_loop = self.index[2 * frames + 1] != 0
+
+    def read_frame(self, reader, frame_number, screen=None):
+        """
+            Read a frame into reader, see FrameReader.read()
+        :param frame_number: 1 to frame_count, 0 for the loop frame
+        """
+        entry = frame_number - 1 if frame_number else self.frame_count
+        self.f.seek(self.index[2 * entry])
+        return reader.read(self.f, screen)
+
+    def read_json(self, entry):
+        f = self.f
+        f.seek(self.index[2 * entry])
+        return json.loads(f.read(self.index[2 * entry + 1]))
+
+    def image_map(self):
+        """
+        :return: what the .map file held
+        """
+        return self.read_json(self.frame_count + 1)
+
+    def segment(self, segment):
+        return self.read_json(self.frame_count + 2 + segment)
+
+    def close(self):
+        self.f.close()
+
+
+def open_cache(cache_dir, image_name):
+    """
+        Open a built cache for playback, packing it first when it is still
+        loose files, converting JSON frames on the way
+    :return: FramePack
+    """
+    pack_name = pack_file_name(cache_dir, image_name)
+    try:
+        os.stat(pack_name)
+    except OSError:
+        if is_json_frame_file(frame_file_name(cache_dir, image_name, 1)):
+            print("converting JSON frame cache:", convert_json_cache(cache_dir, image_name), "frames")
+        print("packing frame cache:", pack_cache(cache_dir, image_name), "frames")
+    else:
+        removed = remove_loose_files(cache_dir, image_name)
+        if removed:
+            print("removed files left from packing:", removed)
+    return FramePack(pack_name)
+
+
+def load_gif_image_map(cache_dir, image_name):
+    try:
+        f = open(map_file_name(cache_dir, image_name), "r")
+        image_map = json.load(f)
+        f.close()
+        return image_map
+    except:
+        print("%s gif image map not found:", image_name, "(expected on first run)")
+        return None
+
+
+def file_hash(file_name):
+    """
+        SHA-256 of a file, read through one small buffer
+    :return: hex digest string
+    """
+    try:
+        import hashlib
+    except ImportError:
+        import uhashlib as hashlib
+    from binascii import hexlify
+    digest = hashlib.sha256()
+    buffer = bytearray(512)
+    view = memoryview(buffer)
+    f = open(file_name, "rb")
+    while True:
+        count = f.readinto(buffer)
+        if not count:
+            break
+        digest.update(view[:count])
+    f.close()
+    return hexlify(digest.digest()).decode()
+
+
+def new_manifest(gif_name):
+    """
+    :return: manifest of a cache of gif_name with no frames yet
+    """
+    info = os.stat(gif_name)
+    return {"version": CACHE_VERSION, "pack": PACK_VERSION, "size": info[6], "mtime": info[8],
+            "hash": file_hash(gif_name), "frames": 0, "complete": False}
+
+
+def read_manifest(cache_dir, image_name):
+    """
+    :return: the manifest, None when there is none or it is unreadable
+    """
+    try:
+        f = open(manifest_file_name(cache_dir, image_name), "r")
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(cache_dir, image_name, manifest):
+    f = open(manifest_file_name(cache_dir, image_name), "w")
+    json.dump(manifest, f)
+    f.close()
+
+
+def same_source(cache_dir, image_name, manifest, gif_name, info):
+    """
+        Whether the manifest was written for the GIF as it is now.  The hash
+        is only worked out when the mtime changed, or the filesystem has none.
+    :param info: os.stat() of the GIF
+    """
+    if manifest.get("size") != info[6]:
+        return False
+    if info[8] and manifest.get("mtime") == info[8]:
+        return True
+    if manifest.get("hash") != file_hash(gif_name):
+        return False
+    # copied or touched, the same bytes: skip the hash next time
+    manifest["mtime"] = info[8]
+    write_manifest(cache_dir, image_name, manifest)
+    return True
+
+
+def clear_cache(cache_dir):
+    """
+        Remove every file of a cache directory, the directory stays
+    """
+    for name in os.listdir(cache_dir):
+        os.remove("/".join((cache_dir, name)))
+
+
+def cache_status(cache_dir, image_name):
+    """
+        Check a cache directory against its GIF
+    :return: (CACHE_ status, manifest to build with), the manifest is a new
+        one for CACHE_MISSING and CACHE_STALE and may be None for CACHE_READY
+    """
+    gif_name = "%s.gif" % image_name
+    try:
+        mode = os.stat(cache_dir)[0]
+    except OSError:
+        return CACHE_MISSING, new_manifest(gif_name)
+    if not stat.S_ISDIR(mode):
+        raise OSError("%s is not a directory" % cache_dir)
+    packed = True
+    try:
+        os.stat(pack_file_name(cache_dir, image_name))
+    except OSError:
+        packed = False
+    manifest = read_manifest(cache_dir, image_name)
+    try:
+        info = os.stat(gif_name)
+    except OSError:
+        # copied to the device without its GIF, e.g. by host/precompile.py
+        if packed or packed_frames(cache_dir, image_name) is not None:
+            return CACHE_READY, manifest
+        raise OSError("%s is not a complete cache and there is no %s" % (cache_dir, gif_name))
+    if manifest is None:
+        # written before manifests, take it as built from this GIF when it packs
+        frames = packed_frames(cache_dir, image_name)
+        if frames is None:
+            return CACHE_STALE, new_manifest(gif_name)
+        manifest = new_manifest(gif_name)
+        manifest["frames"] = frames
+        manifest["complete"] = True
+        write_manifest(cache_dir, image_name, manifest)
+        return CACHE_READY, manifest
+    if (manifest.get("version") != CACHE_VERSION or manifest.get("pack") != PACK_VERSION or
+            not same_source(cache_dir, image_name, manifest, gif_name, info)):
+        return CACHE_STALE, new_manifest(gif_name)
+    if not packed:
+        # the build stopped somewhere before its pack, even after every frame
+        return CACHE_PARTIAL, manifest
+    if not manifest.get("complete"):
+        # stopped between packing and the manifest saying so
+        manifest["complete"] = True
+        write_manifest(cache_dir, image_name, manifest)
+    return CACHE_READY, manifest
+
+
+def packed_frames(cache_dir, image_name):
+    """
+        Open a cache with no manifest to go by, packing its loose files
+    :return: number of frames, None when it is not a complete cache
+    """
+    try:
+        pack = open_cache(cache_dir, image_name)
+    except (OSError, ValueError):
+        return None
+    frames = pack.frame_count
+    pack.close()
+    return frames
+
+
+def finish_cache(cache_dir, image_name, manifest):
+    """
+        Pack a build that wrote every file, then mark its manifest complete
+    :return: number of frames
+    """
+    frames = pack_cache(cache_dir, image_name)
+    manifest["complete"] = True
+    write_manifest(cache_dir, image_name, manifest)
+    return frames
+
+
+def prepare_cache(cache_dir, image_name):
+    """
+        cache_status(), then get the directory ready for a build when the
+        cache is not: created when missing, emptied when stale
+    :return: (CACHE_ status, manifest to build with)
+    """
+    status, manifest = cache_status(cache_dir, image_name)
+    if status == CACHE_MISSING:
+        os.mkdir(cache_dir)
+    elif status == CACHE_STALE:
+        print("frame cache out of date, rebuilding:", cache_dir)
+        clear_cache(cache_dir)
+    return status, manifest
@@ -0,0 +1,697 @@
+"""
+The frame encodings of the cache: how each codec stores a frame and draws
+it back into the display buffer, and the helpers they share
+"""
+import struct
+from gc import collect
+
+# payload is the frame's image map indices, 2 bytes each
+ENCODING_MAP = 0
+# payload is the whole display buffer after the frame is drawn, already
+# rotated and laid out in SSD1306 pages (framebuf MONO_VLSB)
+ENCODING_PAGES = 1
+# payload is the bytes of the display buffer that changed since the previous
+# frame, as spans of offset (2 bytes), length (2 bytes) and the new bytes
+ENCODING_DELTA = 2
+# payload is the image map segment number (2 bytes), then the frame's
+# indices into that segment, 2 bytes each
+ENCODING_SEGMENT_MAP = 3
+# payload is the whole display buffer run-length encoded: a control byte n
+# below 128 is followed by n + 1 bytes to copy, one above 128 by a single
+# byte to repeat 257 - n times
+ENCODING_RLE = 4
+# payload is the rectangle of the display the frame changed and the colour
+# it is cleared to (x, y, width, height, colour: 1 byte each, display
+# coordinates), then the rectangles of the other colour inside it, 4 bytes
+# each, drawn with framebuf hline/vline/fill_rect.  Empty when the frame
+# changed nothing.
+ENCODING_RUNS = 5
+
+# image map indices a map frame draws between yields of Codec.steps()
+MAP_STEP_INDICES = 32
+
+# unchanged gaps shorter than a span header are cheaper to resend than to skip
+DELTA_SPAN_HEADER_SIZE = 4
+
+DISPLAY_WIDTH = 128
+DISPLAY_HEIGHT = 64
+DISPLAY_BUFFER_SIZE = DISPLAY_WIDTH * DISPLAY_HEIGHT // 8
+
+
+def pack_image_data(image_data, segment=None):
+    """
+        Pack image map indices for ENCODING_MAP, or ENCODING_SEGMENT_MAP
+        when a segment is given
+    :param image_data: list of indices into the image map
+    :return: payload bytes
+    """
+    pos = 0 if segment is None else 2
+    payload = bytearray(pos + len(image_data) * 2)
+    if segment is not None:
+        payload[0] = segment & 0xff
+        payload[1] = segment >> 8
+    for index in image_data:
+        payload[pos] = index & 0xff
+        payload[pos + 1] = index >> 8
+        pos += 2
+    return payload
+
+
+@micropython.native
+def diff_screens(old, new):
+    """
+        Build an ENCODING_DELTA payload
+    :param old: display buffer before the frame
+    :param new: display buffer after the frame
+    :return: payload bytearray, empty when nothing changed
+    """
+    payload = bytearray()
+    size = len(new)
+    pos = 0
+    while pos < size:
+        if old[pos] == new[pos]:
+            pos += 1
+            continue
+        start = pos
+        end = pos + 1
+        pos += 1
+        # extend the span over changes separated by short unchanged gaps
+        while pos < size and pos - end < DELTA_SPAN_HEADER_SIZE:
+            if old[pos] != new[pos]:
+                end = pos + 1
+            pos += 1
+        length = end - start
+        payload.extend(struct.pack('<HH', start, length))
+        payload.extend(new[start:end])
+        pos = end
+    return payload
+
+
+@micropython.native
+def apply_delta(screen, payload_view, length):
+    """
+        Copy an ENCODING_DELTA frame's spans into the display buffer
+    :param screen: display buffer memoryview
+    :param payload_view: memoryview of the payload
+    :param length: payload length
+    :return:
+    """
+    pos = 0
+    while pos < length:
+        offset = payload_view[pos] | (payload_view[pos + 1] << 8)
+        count = payload_view[pos + 2] | (payload_view[pos + 3] << 8)
+        pos += DELTA_SPAN_HEADER_SIZE
+        screen[offset:offset + count] = payload_view[pos:pos + count]
+        pos += count
+
+
+def rle_encode(data):
+    """
+        Build an ENCODING_RLE payload
+    :param data: display buffer
+    :return: payload bytearray
+    """
+    payload = bytearray()
+    end = len(data)
+    literal = 0
+    i = 0
+    while i < end:
+        value = data[i]
+        run = 1
+        while i + run < end and run < 128 and data[i + run] == value:
+            run += 1
+        if run < 3:
+            # cheaper to keep in the literal
+            i += run
+            continue
+        rle_literal(payload, data, literal, i)
+        payload.append(257 - run)
+        payload.append(value)
+        i += run
+        literal = i
+    rle_literal(payload, data, literal, end)
+    return payload
+
+
+def rle_literal(payload, data, start, end):
+    while start < end:
+        count = min(end - start, 128)
+        payload.append(count - 1)
+        payload.extend(data[start:start + count])
+        start += count
+
+
+_ZEROS = memoryview(bytes(128))
+_ONES = memoryview(b'\xff' * 128)
+
+
+@micropython.native
+def rle_decode(screen, payload_view, length):
+    """
+        Expand an ENCODING_RLE payload into the display buffer
+    :return:
+    """
+    pos = 0
+    out = 0
+    while pos < length:
+        count = payload_view[pos]
+        pos += 1
+        if count < 128:
+            count += 1
+            screen[out:out + count] = payload_view[pos:pos + count]
+            pos += count
+            out += count
+        elif count > 128:
+            count = 257 - count
+            value = payload_view[pos]
+            pos += 1
+            if value == 0:
+                screen[out:out + count] = _ZEROS[:count]
+            elif value == 0xff:
+                screen[out:out + count] = _ONES[:count]
+            else:
+                for i in range(out, out + count):
+                    screen[i] = value
+            out += count
+
+
+def changed_rectangle(old, new):
+    """
+        The smallest display rectangle holding every pixel that differs
+    :param old: display buffer before the frame
+    :param new: display buffer after the frame
+    :return: (x, y, width, height), None when nothing changed
+    """
+    x0 = DISPLAY_WIDTH
+    x1 = -1
+    y0 = DISPLAY_HEIGHT
+    y1 = -1
+    for i in range(len(new)):
+        bits = old[i] ^ new[i]
+        if not bits:
+            continue
+        x = i % DISPLAY_WIDTH
+        page = (i // DISPLAY_WIDTH) * 8
+        if x < x0:
+            x0 = x
+        if x > x1:
+            x1 = x
+        low = 0
+        while not bits & (1 << low):
+            low += 1
+        high = 7
+        while not bits & (1 << high):
+            high -= 1
+        if page + low < y0:
+            y0 = page + low
+        if page + high > y1:
+            y1 = page + high
+    if x1 < 0:
+        return None
+    return x0, y0, x1 - x0 + 1, y1 - y0 + 1
+
+
+def runs_rectangles(lines, color):
+    """
+        Find the runs of color along each line and merge runs that repeat
+        on the next line into one rectangle
+    :param lines: bytearray of 0/1 pixels per line
+    :return: list of [start, line, run length, lines] rectangles
+    """
+    rectangles = []
+    open_runs = {}
+    for index in range(len(lines)):
+        line = lines[index]
+        size = len(line)
+        current = {}
+        pos = 0
+        while pos < size:
+            if line[pos] != color:
+                pos += 1
+                continue
+            start = pos
+            while pos < size and line[pos] == color:
+                pos += 1
+            key = (start << 8) | pos
+            rectangle = open_runs.get(key)
+            if rectangle is None:
+                rectangle = [start, index, pos - start, 0]
+                rectangles.append(rectangle)
+            rectangle[3] += 1
+            current[key] = rectangle
+        open_runs = current
+    return rectangles
+
+
+def runs_encode(old, new, whole):
+    """
+        Build an ENCODING_RUNS payload, rows or columns, whichever takes
+        fewer rectangles
+    :param old: display buffer before the frame
+    :param new: display buffer after the frame
+    :param whole: cover the whole display, for frames that have to decode
+        on their own
+    :return: payload bytearray
+    """
+    if whole:
+        rectangle = (0, 0, DISPLAY_WIDTH, DISPLAY_HEIGHT)
+    else:
+        rectangle = changed_rectangle(old, new)
+        if rectangle is None:
+            return bytearray()
+    x0, y0, width, height = rectangle
+    rows = [bytearray(width) for _ in range(height)]
+    columns = [bytearray(height) for _ in range(width)]
+    ones = 0
+    for y in range(height):
+        row = rows[y]
+        page = ((y0 + y) >> 3) * DISPLAY_WIDTH
+        bit = 1 << ((y0 + y) & 7)
+        for x in range(width):
+            if new[page + x0 + x] & bit:
+                row[x] = 1
+                columns[x][y] = 1
+                ones += 1
+    # clear to the more common colour, draw the other
+    background = 1 if ones * 2 > width * height else 0
+    color = background ^ 1
+    across = runs_rectangles(rows, color)
+    down = runs_rectangles(columns, color)
+    payload = bytearray((x0, y0, width, height, background))
+    if len(across) <= len(down):
+        for start, line, length, lines in across:
+            payload.extend((x0 + start, y0 + line, length, lines))
+    else:
+        for start, line, length, lines in down:
+            payload.extend((x0 + line, y0 + start, lines, length))
+    return payload
+
+
+@micropython.native
+def runs_decode(fb, payload, length):
+    """
+        Draw an ENCODING_RUNS payload, one framebuf call per rectangle
+    :param fb: framebuf.FrameBuffer of the display buffer
+    :return:
+    """
+    if length == 0:
+        return
+    color = payload[4] ^ 1
+    fb.fill_rect(payload[0], payload[1], payload[2], payload[3], payload[4])
+    fill_rect = fb.fill_rect
+    hline = fb.hline
+    vline = fb.vline
+    for pos in range(5, length, 4):
+        width = payload[pos + 2]
+        height = payload[pos + 3]
+        if height == 1:
+            hline(payload[pos], payload[pos + 1], width, color)
+        elif width == 1:
+            vline(payload[pos], payload[pos + 1], height, color)
+        else:
+            fill_rect(payload[pos], payload[pos + 1], width, height, color)
+
+
+def runs_region(payload, length, region):
+    """
+        The (x0, page0, x1, page1) region of an ENCODING_RUNS frame's rectangle
+    :return: region, or SHOW_NOTHING when the frame changed nothing
+    """
+    if length == 0:
+        return SHOW_NOTHING
+    region[0] = payload[0]
+    region[1] = payload[1] >> 3
+    region[2] = payload[0] + payload[2] - 1
+    region[3] = (payload[1] + payload[3] - 1) >> 3
+    return region
+
+
+class Codec:
+    """
+    One way of storing a frame in the cache
+
+    The cache builder asks each codec it was given for a payload and keeps
+    one per frame, its encoding goes in the frame header so playback can
+    pick the codec back out of CODECS.
+
+    Each codec defines:
+
+        encode(builder, image)  payload, None when it cannot store the frame;
+                                builder.screen holds the frame drawn and
+                                builder.previous the frame before it
+        decode(reader, screen, fb, segments)
+                                draw the frame in reader into screen, fb is
+                                a framebuf.FrameBuffer drawing into it and
+                                segments the cache's MapSegments
+    """
+    encoding = None
+
+    def keyframe(self, builder, image):
+        """
+        :return: True when the frame decodes without the frame before it
+        """
+        return True
+
+    def steps(self, reader, screen, fb, segments):
+        """
+            decode() in steps, a generator that yields between them so a
+            cooperative player can let other tasks run
+        """
+        self.decode(reader, screen, fb, segments)
+        return
+        yield
+
+    def region(self, reader, region, whole):
+        """
+        :param whole: the whole display may differ from the frame before
+        :return: what of the display the frame changed, for SSD1306.show()
+        """
+        if whole:
+            return SHOW_ALL
+        return frame_region(reader, region)
+
+
+class PagesCodec(Codec):
+    """
+    The display buffer as it is, copied in one go
+    """
+    encoding = ENCODING_PAGES
+
+    def encode(self, builder, image):
+        return builder.screen
+
+    def decode(self, reader, screen, fb, segments):
+        # FrameReader.read() given the screen already put the pages there
+        if not reader.in_screen:
+            screen[:] = reader.payload_view[:DISPLAY_BUFFER_SIZE]
+
+
+class DeltaCodec(Codec):
+    """
+    The bytes that changed since the frame before
+    """
+    encoding = ENCODING_DELTA
+
+    def keyframe(self, builder, image):
+        return False
+
+    def encode(self, builder, image):
+        return diff_screens(builder.previous, builder.screen)
+
+    def decode(self, reader, screen, fb, segments):
+        apply_delta(screen, reader.payload_view, reader.length)
+
+    def region(self, reader, region, whole):
+        # exact even after looping
+        return delta_region(reader.payload, reader.length, region)
+
+
+class RunLengthCodec(Codec):
+    """
+    The display buffer run-length encoded, for frames of large blank or
+    filled areas
+    """
+    encoding = ENCODING_RLE
+
+    def encode(self, builder, image):
+        return rle_encode(builder.screen)
+
+    def decode(self, reader, screen, fb, segments):
+        rle_decode(screen, reader.payload_view, reader.length)
+
+
+class DictionaryCodec(Codec):
+    """
+    The frame's indices into the image map, the GIF's LZW strings shared by
+    every frame.  Needs the GIF parsed without GiPyF.parse(packed=True).
+    """
+    encoding = ENCODING_SEGMENT_MAP
+
+    def keyframe(self, builder, image):
+        # only redraws its own rectangle
+        gif = builder.gif
+        return (image.top_left_x == 0 and image.top_left_y == 0 and
+                image.width >= gif.width and image.height >= gif.height)
+
+    def encode(self, builder, image):
+        if image.pixels is not None:
+            return None
+        return builder.map_frame(image)
+
+    def decode(self, reader, screen, fb, segments):
+        segments.draw(reader, fb.pixel)
+
+    def steps(self, reader, screen, fb, segments):
+        # drawn one pixel at a time, the only codec slow enough to split
+        image_map, pos = segments.frame_entries(reader)
+        pixel = fb.pixel
+        length = reader.length
+        position = None
+        while pos < length:
+            end = pos + 2 * MAP_STEP_INDICES
+            if end > length:
+                end = length
+            position = draw_frame(reader, image_map, pixel, pos, end, position)
+            pos = end
+            yield
+
+
+class RunsCodec(Codec):
+    """
+    Rectangles of one colour in display coordinates, for frames of large
+    single colour areas: drawing takes one framebuf call per rectangle
+    instead of one per pixel
+    """
+    encoding = ENCODING_RUNS
+
+    def encode(self, builder, image):
+        payload = runs_encode(builder.previous, builder.screen, builder.standalone)
+        if len(payload) > DISPLAY_BUFFER_SIZE:
+            # too busy, pages draw it faster and smaller
+            return None
+        return payload
+
+    def decode(self, reader, screen, fb, segments):
+        runs_decode(fb, reader.payload, reader.length)
+
+    def region(self, reader, region, whole):
+        if whole:
+            return SHOW_ALL
+        return runs_region(reader.payload, reader.length, region)
+
+
+CODECS = {
+    ENCODING_PAGES: PagesCodec(),
+    ENCODING_DELTA: DeltaCodec(),
+    ENCODING_RLE: RunLengthCodec(),
+    ENCODING_SEGMENT_MAP: DictionaryCodec(),
+    ENCODING_RUNS: RunsCodec(),
+}
+# frames of caches written before segments decode the same way
+CODECS[ENCODING_MAP] = CODECS[ENCODING_SEGMENT_MAP]
+
+
+class MapSegments:
+    """
+    Image map entries for ENCODING_MAP and ENCODING_SEGMENT_MAP frames
+
+    A cache written before segments has its whole image map in the .map
+    file.  Otherwise the .map file only holds the number of segments and
+    the segment a frame uses is loaded when it differs from the one in RAM.
+    """
+
+    def __init__(self, image_map, pack=None):
+        """
+        :param image_map: what the .map file holds
+        :param pack: FramePack the segments are read from
+        """
+        self.pack = pack
+        if isinstance(image_map, list):
+            self.entries = image_map
+        else:
+            self.entries = None
+        self.segment = None
+        self.loads = 0
+
+    def get(self, segment):
+        if segment != self.segment:
+            # let the old segment go before the new one is parsed
+            self.entries = None
+            collect()
+            self.entries = self.pack.segment(segment)
+            self.segment = segment
+            self.loads += 1
+        return self.entries
+
+    def frame_entries(self, reader):
+        """
+        :return: (entries, payload offset of the first index) of the map frame in reader
+        """
+        if reader.encoding == ENCODING_SEGMENT_MAP:
+            payload = reader.payload
+            return self.get(payload[0] | (payload[1] << 8)), 2
+        return self.entries, 0
+
+    def draw(self, reader, pixel):
+        """
+            Draw the map frame in reader
+        """
+        image_map, start = self.frame_entries(reader)
+        draw_frame(reader, image_map, pixel, start)
+
+
+@micropython.native
+def draw_frame(reader, image_map, pixel, start=0, end=None, position=None):
+    """
+        Draw an ENCODING_MAP frame from reader's payload one pixel at a time
+    :param reader: FrameReader holding the frame
+    :param image_map: image map entries
+    :param pixel: framebuf pixel function
+    :param start: payload offset of the first index
+    :param end: payload offset to stop at, the end of the payload when None
+    :param position: what the previous call returned, when drawing a frame
+        in parts
+    :return: (x, y) the next pixel goes to
+    """
+    top_left_x = reader.top_left_x
+
+    if position is None:
+        current_x = top_left_x
+        current_y = reader.top_left_y
+    else:
+        current_x, current_y = position
+
+    max_x = top_left_x + reader.width
+    if end is None:
+        end = reader.length
+
+    # decompress the image data into a 0-based buffer
+    payload = reader.payload
+    for payload_index in range(start, end, 2):
+        data_index = payload[payload_index] | (payload[payload_index + 1] << 8)
+        for entry in image_map[data_index]:
+            if isinstance(entry, int):
+                pixel(127-current_y, current_x, (entry & 0x80)>>7)
+                current_x += 1
+                if current_x >= max_x:
+                    current_x = top_left_x
+                    current_y += 1
+
+                pixel(127-current_y, current_x, (entry & 0x40)>>6)
+                current_x += 1
+                if current_x >= max_x:
+                    current_x = top_left_x
+                    current_y += 1
+
+                pixel(127-current_y, current_x, (entry & 0x20)>>5)
+                current_x += 1
+                if current_x >= max_x:
+                    current_x = top_left_x
+                    current_y += 1
+
+                pixel(127-current_y, current_x, (entry & 0x10)>>4)
+                current_x += 1
+                if current_x >= max_x:
+                    current_x = top_left_x
+                    current_y += 1
+
+                pixel(127-current_y, current_x, (entry & 0x08)>>3)
+                current_x += 1
+                if current_x >= max_x:
+                    current_x = top_left_x
+                    current_y += 1
+
+                pixel(127-current_y, current_x, (entry & 0x04)>>2)
+                current_x += 1
+                if current_x >= max_x:
+                    current_x = top_left_x
+                    current_y += 1
+
+                pixel(127-current_y, current_x, (entry & 0x02)>>1)
+                current_x += 1
+                if current_x >= max_x:
+                    current_x = top_left_x
+                    current_y += 1
+
+                pixel(127-current_y, current_x, (entry & 0x01))
+                current_x += 1
+                if current_x >= max_x:
+                    current_x = top_left_x
+                    current_y += 1
+            else:
+                for item in entry:
+                    pixel(127-current_y, current_x, 1 if item else 0)
+                    current_x += 1
+                    if current_x >= max_x:
+                        current_x = top_left_x
+                        current_y += 1
+    return current_x, current_y
+
+
+@micropython.native
+def frame_region(reader, region):
+    """
+        Work out which part of the display a frame can have changed: its GIF
+        rectangle, rotated like render_frame, as the (x0, page0, x1, page1)
+        region SSD1306.show() takes
+    :param reader: FrameReader holding the frame
+    :param region: 4 item list to fill in
+    :return: region
+    """
+    last_column = DISPLAY_WIDTH - 1
+    last_page = DISPLAY_HEIGHT // 8 - 1
+    x0 = last_column - (reader.top_left_y + reader.height - 1)
+    x1 = last_column - reader.top_left_y
+    page0 = reader.top_left_x >> 3
+    page1 = (reader.top_left_x + reader.width - 1) >> 3
+    region[0] = x0 if x0 > 0 else 0
+    region[1] = page0 if page0 < last_page else last_page
+    region[2] = x1 if x1 > 0 else 0
+    region[3] = page1 if page1 < last_page else last_page
+    return region
+
+
+@micropython.native
+def delta_region(payload, length, region):
+    """
+        The (x0, page0, x1, page1) region covering an ENCODING_DELTA frame's spans
+    :param payload: the frame's payload
+    :param length: payload length
+    :param region: 4 item list to fill in
+    :return: region, or SHOW_NOTHING when the frame changed nothing
+    """
+    if length == 0:
+        return SHOW_NOTHING
+    x0 = DISPLAY_WIDTH - 1
+    x1 = 0
+    first = -1
+    last = 0
+    pos = 0
+    while pos < length:
+        start = payload[pos] | (payload[pos + 1] << 8)
+        end = start + (payload[pos + 2] | (payload[pos + 3] << 8)) - 1
+        pos += DELTA_SPAN_HEADER_SIZE + end - start + 1
+        if first < 0:
+            first = start
+        last = end
+        if start // DISPLAY_WIDTH != end // DISPLAY_WIDTH:
+            # span wraps onto the next page
+            x0 = 0
+            x1 = DISPLAY_WIDTH - 1
+        else:
+            column = start % DISPLAY_WIDTH
+            if column < x0:
+                x0 = column
+            column = end % DISPLAY_WIDTH
+            if column > x1:
+                x1 = column
+    region[0] = x0
+    region[1] = first // DISPLAY_WIDTH
+    region[2] = x1
+    region[3] = last // DISPLAY_WIDTH
+    return region
+
+
+# show_gif_frames region values besides an (x0, page0, x1, page1) region
+SHOW_ALL = None
+SHOW_NOTHING = ()
@@ -1,22 +1,306 @@
 
 from gipyf import GiPyF
 from gipyf import Image
-import os
+from gipyf import GCPolicy
+from gipyf import mem_free
+from gipyf import _readinto_sized
+from gifcache import CACHE_VERSION
+from gifcache import FRAME_HEADER_SIZE
+from gifcache import frame_file_name
+from gifcache import loop_file_name
+from gifcache import map_file_name
+from gifcache import segment_file_name
+from gifcache import write_frame
+from gifcache import finish_cache
+from gifcache import open_cache
+from gifcache import CACHE_READY
+from gifcache import new_manifest
+from gifcache import write_manifest
+from gifcache import prepare_cache
+from gifcodec import DISPLAY_WIDTH
+from gifcodec import DISPLAY_HEIGHT
+from gifcodec import DISPLAY_BUFFER_SIZE
+from gifcodec import ENCODING_MAP
+from gifcodec import ENCODING_PAGES
+from gifcodec import ENCODING_DELTA
+from gifcodec import ENCODING_SEGMENT_MAP
+from gifcodec import ENCODING_RLE
+from gifcodec import ENCODING_RUNS
+from gifcodec import SHOW_ALL
+from gifcodec import SHOW_NOTHING
+from gifcodec import CODECS
+from gifcodec import MapSegments
+from gifcodec import pack_image_data
+from gifcodec import diff_screens
+from gifcodec import apply_delta
+from gifcodec import frame_region
 import json
 import utime
-import sys
-import os
-import stat
+from array import array
 import machine
+import perf
+from gc import collect
 
 _play_delay = None 
 _oled = None
 
+# how the cache builder picks between encodings, per frame:
+# the smallest payload
+OBJECTIVE_SIZE = 0
+# the fastest to decode, timed while building
+OBJECTIVE_SPEED = 1
+# encodings tried when none is given
+AUTO_ENCODINGS = (ENCODING_PAGES, ENCODING_DELTA, ENCODING_RLE, ENCODING_RUNS)
+
+# Caches written with ENCODING_MAP split the image map into segment files of
+# at most this many entries and bytes, playback only loads the segment the
+# current frame uses
+MAP_SEGMENT_ENTRIES = 1024
+MAP_SEGMENT_BYTES = 8192
+# what happens to a frame whose new entries do not fit in the segment:
+# start the next segment with the entries the frame uses
+MAP_FULL_NEW_SEGMENT = 0
+# write that frame as ENCODING_PAGES and keep the segment as it is
+MAP_FULL_LITERAL = 1
+
+class FrameReader:
+    """
+    Reads cached frames into one header and one payload buffer, both reused
+    for every frame.  The payload buffer only grows when a larger frame shows
+    up, so once every frame has been seen reading allocates nothing.
+    """
+
+    def __init__(self, payload_size=1024):
+        self.header = bytearray(FRAME_HEADER_SIZE)
+        self.payload = bytearray(payload_size)
+        self.payload_view = memoryview(self.payload)
+        self.encoding = 0
+        self.delay = 0
+        self.width = 0
+        self.height = 0
+        self.top_left_x = 0
+        self.top_left_y = 0
+        self.length = 0
+        # the payload went straight into the screen given to read()
+        self.in_screen = False
+
+    @micropython.native
+    def read(self, f, screen=None):
+        """
+            Read the frame at the current position of f
+        :param f: binary file object
+        :param screen: display buffer, ENCODING_PAGES payloads are read
+            straight into it instead of the payload buffer
+        :return: False at the end of the file
+        """
+        h = self.header
+        if f.readinto(h) != FRAME_HEADER_SIZE:
+            return False
+        if h[0] != 0x47 or h[1] != 0x56:
+            raise ValueError("not a frame cache file")
+        if h[2] != CACHE_VERSION:
+            raise ValueError("unsupported frame cache version %d" % h[2])
+        self.encoding = h[3]
+        self.delay = h[4] | (h[5] << 8)
+        self.width = h[6] | (h[7] << 8)
+        self.height = h[8] | (h[9] << 8)
+        self.top_left_x = h[10] | (h[11] << 8)
+        self.top_left_y = h[12] | (h[13] << 8)
+        length = h[14] | (h[15] << 8) | (h[16] << 16) | (h[17] << 24)
+        self.length = length
+        if screen is not None and self.encoding == ENCODING_PAGES:
+            f.readinto(screen)
+            self.in_screen = True
+            return True
+        self.in_screen = False
+        if length > len(self.payload):
+            self.payload = bytearray(length)
+            self.payload_view = memoryview(self.payload)
+        if _readinto_sized:
+            f.readinto(self.payload, length)
+        else:
+            f.readinto(self.payload_view[:length])
+        return True
+
+    def read_file(self, file_name, screen=None):
+        f = open(file_name, "rb")
+        try:
+            return self.read(f, screen)
+        finally:
+            f.close()
+
+
+@micropython.native
+def render_frame(screen, image_map, image_data, width, top_left_x, top_left_y):
+    """
+        Draw a frame into a display buffer the way show_gif_frames draws it
+        with pixel(127 - y, x, ...): the GIF is rotated 90 degrees onto the
+        display and each display column byte holds 8 vertical pixels.
+        Pixels off the display are left out, as pixel() leaves them out.
+    :param screen: DISPLAY_BUFFER_SIZE bytearray holding the previous frame
+    :param image_map: image map entries
+    :param image_data: frame's indices into image_map
+    :return:
+    """
+    last_column = DISPLAY_WIDTH - 1
+    # GIF x becomes the display row, GIF y the display column
+    max_y = DISPLAY_WIDTH
+    visible_x = DISPLAY_HEIGHT
+    current_x = top_left_x
+    current_y = top_left_y
+    max_x = top_left_x + width
+    for data_index in image_data:
+        for entry in image_map[data_index]:
+            if isinstance(entry, int):
+                count = 8
+                bits = entry
+            else:
+                count = len(entry)
+                bits = 0
+                for item in entry:
+                    bits = (bits << 1) | (1 if item else 0)
+            while count > 0:
+                count -= 1
+                if current_x < visible_x and current_y < max_y:
+                    index = (current_x >> 3) * DISPLAY_WIDTH + last_column - current_y
+                    if (bits >> count) & 1:
+                        screen[index] |= 1 << (current_x & 7)
+                    else:
+                        screen[index] &= ~(1 << (current_x & 7))
+                current_x += 1
+                if current_x >= max_x:
+                    current_x = top_left_x
+                    current_y += 1
+
+
+@micropython.native
+def render_pixels(screen, pixels, width, height, top_left_x, top_left_y):
+    """
+        Draw a frame decoded by Image.unpack_pixels into a display buffer,
+        rotated and clipped like render_frame
+    :param screen: DISPLAY_BUFFER_SIZE bytearray holding the previous frame
+    :param pixels: the frame's packed pixels
+    :return:
+    """
+    last_column = DISPLAY_WIDTH - 1
+    # GIF rows past the last display column and columns past the last page are off the display
+    rows = min(height, DISPLAY_WIDTH - top_left_y)
+    if top_left_x & 7 == 0 and width & 7 == 0:
+        # every packed byte is a whole display byte: 8 pixels of a GIF row
+        row_bytes = width >> 3
+        visible_bytes = min(row_bytes, (DISPLAY_HEIGHT - top_left_x) >> 3)
+        first = (top_left_x >> 3) * DISPLAY_WIDTH + last_column - top_left_y
+        for y in range(rows):
+            index = first - y
+            source = y * row_bytes
+            for i in range(visible_bytes):
+                screen[index] = pixels[source]
+                source += 1
+                index += DISPLAY_WIDTH
+        return
+    end_x = min(top_left_x + width, DISPLAY_HEIGHT)
+    for y in range(rows):
+        column = last_column - top_left_y - y
+        bit = y * width
+        for x in range(top_left_x, end_x):
+            index = (x >> 3) * DISPLAY_WIDTH + column
+            if pixels[bit >> 3] & (1 << (bit & 7)):
+                screen[index] |= 1 << (x & 7)
+            else:
+                screen[index] &= ~(1 << (x & 7))
+            bit += 1
+
+
 class ImageProcessingCallbacks:
-    def __init__(self, cache_dir, image_name, gif):
+    def __init__(self, cache_dir, image_name, gif, encoding=AUTO_ENCODINGS,
+                 map_entries=MAP_SEGMENT_ENTRIES, map_bytes=MAP_SEGMENT_BYTES, map_full=MAP_FULL_NEW_SEGMENT,
+                 objective=OBJECTIVE_SIZE):
+        """
+        :param encoding: an ENCODING_ constant, or a tuple of them for each
+            frame to use whichever suits objective best
+        """
         self.cache_dir = cache_dir
         self.image_name = image_name
         self.gif = gif
+        encodings = encoding if isinstance(encoding, tuple) else (encoding,)
+        self.codecs = [CODECS[ENCODING_SEGMENT_MAP if e == ENCODING_MAP else e] for e in encodings]
+        self.objective = objective
+        # the image map is only built when a codec uses it
+        self.uses_map = ENCODING_MAP in encodings
+        self.uses_delta = ENCODING_DELTA in encodings
+        # for timing decodes with OBJECTIVE_SPEED
+        self.scratch = None
+        if self.uses_map:
+            gif.image_map.max_entries = map_entries
+            gif.image_map.max_bytes = map_bytes
+            self.map_full = map_full
+            # segment being filled, and its size before the current frame
+            self.segment = 0
+            self.mark = 0
+        # delay of the last cached frame
+        self.delay = 0
+        # display contents after the last frame, frames only redraw their own rectangle
+        self.screen = bytearray(DISPLAY_BUFFER_SIZE)
+        # what the display showed before this frame, and after frame 1
+        self.previous = bytearray(DISPLAY_BUFFER_SIZE)
+        self.first = None
+        self.first_delay = 0
+        # the frame being cached has to decode without the one before it
+        self.standalone = False
+        # updated after every frame once resume() has been called
+        self.manifest = None
+
+    def resume(self, manifest):
+        """
+            Start the cache under manifest, carrying on after the frames an
+            interrupted build already wrote
+        :param manifest: see cache_status()
+        :return: frames already written, for GiPyF.parse(skip_frames=...)
+        """
+        frames = manifest["frames"]
+        # the image map of the frames written was only ever in RAM
+        if frames and not self.uses_map:
+            frames = self.redraw(frames)
+        else:
+            frames = 0
+        if frames:
+            print("resuming frame cache after frame", frames)
+        manifest["frames"] = frames
+        self.manifest = manifest
+        write_manifest(self.cache_dir, self.image_name, manifest)
+        return frames
+
+    def redraw(self, frames):
+        """
+            Draw the cached frames again, leaving the builder as it was after
+            the last of them
+        :return: frames drawn, 0 when they could not all be
+        """
+        import framebuf
+        fb = framebuf.FrameBuffer1(self.screen, DISPLAY_WIDTH, DISPLAY_HEIGHT)
+        reader = FrameReader()
+        segments = MapSegments(None)
+        try:
+            for frame_number in range(1, frames + 1):
+                if not reader.read_file(frame_file_name(self.cache_dir, self.image_name, frame_number),
+                                        self.screen):
+                    raise ValueError("empty frame file")
+                if reader.encoding == ENCODING_MAP or reader.encoding == ENCODING_SEGMENT_MAP:
+                    raise ValueError("map frame")
+                CODECS[reader.encoding].decode(reader, self.screen, fb, segments)
+                if frame_number == 1:
+                    self.first = bytearray(self.screen)
+                    self.first_delay = reader.delay
+                self.delay = reader.delay
+        except (OSError, ValueError, KeyError) as e:
+            print("frame cache not resumable:", e)
+            self.screen[:] = bytes(DISPLAY_BUFFER_SIZE)
+            self.first = None
+            self.first_delay = 0
+            self.delay = 0
+            return 0
+        self.previous[:] = self.screen
+        return frames
 
     def gce_cb(self, color_alpha_index, play_delay):
         global _play_delay
@@ -31,8 +315,6 @@ class ImageProcessingCallbacks:
         _play_delay = play_delay
 
     def frame_cb(self, frame_number, image):
-        global _start_time, _play_delay
-
         global _oled
         _oled.fill(0)
         _oled.text("Initializing", 1, 1)
@@ -40,147 +322,632 @@ class ImageProcessingCallbacks:
         _oled.text("frame: %d" % frame_number, 1, 20)
         _oled.show()
 
+        self.cache_frame(frame_number, image)
+
+    def cache_frame(self, frame_number, image):
+        global _play_delay
+
         print("writing frame cache:", frame_number)
-        # write the frame details to a local JSON file on the microcontroller
-        f = open("%s_%d.bin" % ("/".join((self.cache_dir, self.image_name)), frame_number), "w")
-        json.dump((_play_delay, image.width, image.height, image.top_left_x, image.top_left_y, image.image_data), f)
+        prof = perf.recorder()
+        if prof is not None:
+            start = utime.ticks_us()
+        # write the frame details to a local file on the microcontroller
+        delay = _play_delay[0] | (_play_delay[1] << 8) if _play_delay else 0
+        self.delay = delay
+        if image.pixels is not None:
+            render_pixels(self.screen, image.pixels, image.width, image.height,
+                          image.top_left_x, image.top_left_y)
+        else:
+            render_frame(self.screen, self.gif.image_map_list, image.image_data,
+                         image.width, image.top_left_x, image.top_left_y)
+        first = self.first is None
+        self.standalone = first
+        if first:
+            self.first = bytearray(self.screen)
+            self.first_delay = delay
+
+        best = None
+        payload = None
+        best_score = 0
+        for codec in self.codecs:
+            # frame 1 has to decode on its own so playback can start from it
+            if first and not codec.keyframe(self, image):
+                continue
+            candidate = codec.encode(self, image)
+            if candidate is None:
+                continue
+            if len(self.codecs) == 1:
+                best = codec
+                payload = candidate
+                break
+            if self.objective == OBJECTIVE_SPEED:
+                score = self.decode_time(codec, candidate, image)
+            else:
+                score = len(candidate)
+            if best is None or score < best_score:
+                best = codec
+                payload = candidate
+                best_score = score
+        if best is None:
+            best = CODECS[ENCODING_PAGES]
+            payload = self.screen
+        encoding = best.encoding
+        self.previous[:] = self.screen
+        if prof is not None:
+            start = prof.lap('render', start)
+        f = open(frame_file_name(self.cache_dir, self.image_name, frame_number), "wb")
+        write_frame(f, delay, image.width, image.height, image.top_left_x, image.top_left_y,
+                    encoding, payload)
         f.flush()
         f.close()
+        if self.manifest is not None:
+            self.manifest["frames"] = frame_number
+            write_manifest(self.cache_dir, self.image_name, self.manifest)
+        if prof is not None:
+            prof.lap('write', start)
         _play_delay = None
 
+    def decode_time(self, codec, payload, image):
+        """
+            Time decoding a payload on top of the previous frame
+        :return: microseconds
+        """
+        if self.scratch is None:
+            import framebuf
+            self.scratch = bytearray(DISPLAY_BUFFER_SIZE)
+            self.scratch_fb = framebuf.FrameBuffer1(self.scratch, DISPLAY_WIDTH, DISPLAY_HEIGHT)
+            self.scratch_reader = FrameReader(0)
+            self.segments = MapSegments(None)
+        reader = self.scratch_reader
+        reader.encoding = codec.encoding
+        reader.width = image.width
+        reader.height = image.height
+        reader.top_left_x = image.top_left_x
+        reader.top_left_y = image.top_left_y
+        reader.payload = payload
+        reader.payload_view = memoryview(payload)
+        reader.length = len(payload)
+        reader.in_screen = False
+        if self.uses_map:
+            # the segment being written is still in RAM
+            self.segments.entries = self.gif.image_map_list
+            self.segments.segment = self.segment
+        self.scratch[:] = self.previous
+        start = utime.ticks_us()
+        codec.decode(reader, self.scratch, self.scratch_fb, self.segments)
+        return utime.ticks_diff(utime.ticks_us(), start)
 
-def create_gif_image_files(cache_dir, image_name):
+    def map_frame(self, image):
+        """
+            Fit a frame's image map entries in the current segment
+        :return: ENCODING_SEGMENT_MAP payload, None when the frame does not fit
+        """
+        image_map = self.gif.image_map
+        entries = image_map.entries
+        image_data = image.image_data
+        if image_map.is_full():
+            # take back what this frame added
+            mark = self.mark
+            removed = image_map.truncate(mark)
+            items = [entries[i] if i < mark else removed[i - mark] for i in image_data]
+            image_data = None
+            if self.map_full == MAP_FULL_NEW_SEGMENT and mark:
+                self.write_segment()
+                image_data = [image_map.add(item) for item in items]
+                if image_map.is_full():
+                    # too big for a segment of its own
+                    image_map.truncate(0)
+                    image_data = None
+            if image_data is None:
+                self.mark = image_map.get_size()
+                return None
+        self.mark = image_map.get_size()
+        return pack_image_data(image_data, self.segment)
+
+    def write_segment(self):
+        """
+            Write the image map as the current segment and start the next one
+        :return:
+        """
+        f = open(segment_file_name(self.cache_dir, self.image_name, self.segment), "w")
+        json.dump(self.gif.image_map_list, f)
+        f.close()
+        self.gif.image_map.truncate(0)
+        self.segment += 1
+        self.mark = 0
+
+    def write_map(self):
+        """
+            Write the image map file, the last file before the pack
+        :return:
+        """
+        if self.uses_map:
+            if self.gif.image_map.get_size():
+                self.write_segment()
+            image_map = {"segments": self.segment}
+        else:
+            image_map = self.gif.image_map_list
+        f = open(map_file_name(self.cache_dir, self.image_name), "w")
+        json.dump(image_map, f)
+        f.flush()
+        f.close()
+
+    def finish(self):
+        """
+            Write the loop frame, the delta from the last frame back to frame 1
+        :return:
+        """
+        if not self.uses_delta or self.first is None:
+            return
+        f = open(loop_file_name(self.cache_dir, self.image_name), "wb")
+        write_frame(f, self.first_delay, 0, 0, 0, 0, ENCODING_DELTA, diff_screens(self.screen, self.first))
+        f.flush()
+        f.close()
+
+
+def create_gif_image_files(cache_dir, image_name, encoding=AUTO_ENCODINGS, gc_policy=None,
+                           map_entries=MAP_SEGMENT_ENTRIES, map_bytes=MAP_SEGMENT_BYTES,
+                           map_full=MAP_FULL_NEW_SEGMENT, objective=OBJECTIVE_SIZE, manifest=None):
+    """
+    :param manifest: from cache_status(), a CACHE_PARTIAL one resumes the
+        build; a new one by default
+    """
+    gif_name = "%s.gif" % image_name
+    if manifest is None:
+        manifest = new_manifest(gif_name)
     gif = GiPyF()
-    cbHandler = ImageProcessingCallbacks(cache_dir, image_name, gif)
-    # write each frame first
-    gif.parse("%s.gif" % image_name, cbHandler.frame_cb, cbHandler.gce_cb)
-    # write the image map last as this is the trigger on startup to determine
-    # which mode we are in
-    f  = open("%s.map" % ("/".join((cache_dir, image_name))), "w")
-    json.dump(gif.image_map_list,f)
-    f.flush()
-    f.close
-
-def sleep_remaining_frame_delay_time(start_time_ms, frame_delay):
-    if start_time_ms and frame_delay:
-        delay_in_ms = frame_delay[0] * 10  # play_delay is defined in 1/100th second
-        delta_in_ms = utime.ticks_diff(utime.ticks_ms(), start_time_ms)
-        delay_in_ms = delay_in_ms - delta_in_ms
-        if delay_in_ms > 0:
-            utime.sleep(delay_in_ms/1000)
+    cbHandler = ImageProcessingCallbacks(cache_dir, image_name, gif, encoding, map_entries, map_bytes, map_full,
+                                         objective)
+    skip_frames = cbHandler.resume(manifest)
+    if gc_policy is None:
+        gc_policy = GCPolicy()
+    # write each frame first, only map frames need the image map
+    gif.parse(gif_name, cbHandler.frame_cb, cbHandler.gce_cb, gc_policy=gc_policy,
+              packed=not cbHandler.uses_map, skip_frames=skip_frames)
+    gc_policy.report()
+    cbHandler.finish()
+    cbHandler.write_map()
+    # the manifest is the trigger on startup to determine which mode we are
+    # in, it is only marked complete once the pack is written
+    finish_cache(cache_dir, image_name, manifest)
+
+class PlayingCallbacks(ImageProcessingCallbacks):
+    """
+    Shows every frame as soon as it is decoded and cached, for single pass mode
+    """
+
+    def __init__(self, cache_dir, image_name, gif, start_time_ms, scheduler):
+        super().__init__(cache_dir, image_name, gif, ENCODING_DELTA)
+        self.start_time_ms = start_time_ms
+        self.scheduler = scheduler
+        self.pending = SHOW_NOTHING
+        self.region = [0, 0, 0, 0]
+
+    def frame_cb(self, frame_number, image):
+        global _oled
+        self.cache_frame(frame_number, image)
+
+        # cache_frame left the frame drawn in self.screen
+        display_screen(_oled)[:] = self.screen
+        if frame_number == 1:
+            changed = SHOW_ALL
+        else:
+            changed = merge_region(self.pending, frame_region(image, self.region))
+        if not self.scheduler.wait(self.delay):
+            self.pending = changed if changed is SHOW_ALL else tuple(changed)
+            return
+        self.pending = SHOW_NOTHING
+        if changed is SHOW_ALL:
+            _oled.show()
+        else:
+            _oled.show(changed)
+        # the first frame shown, frame 1 or the first after a resumed build
+        report_first_frame(self.start_time_ms)
+        self.start_time_ms = None
+
+
+def play_while_creating_gif_image_files(cache_dir, image_name, start_time_ms, scheduler, manifest=None):
+    """
+        Decode, cache and show the frames in one pass, without a reset
+    :param scheduler: FrameScheduler, playback from the cache carries on with it
+    :param manifest: see create_gif_image_files()
+    :return:
+    """
+    gif_name = "%s.gif" % image_name
+    if manifest is None:
+        manifest = new_manifest(gif_name)
+    gif = GiPyF()
+    cbHandler = PlayingCallbacks(cache_dir, image_name, gif, start_time_ms, scheduler)
+    if cbHandler.resume(manifest):
+        # the display has none of the frames skipped
+        cbHandler.pending = SHOW_ALL
+    gc_policy = GCPolicy()
+    gif.parse(gif_name, cbHandler.frame_cb, cbHandler.gce_cb, gc_policy=gc_policy, packed=True,
+              skip_frames=manifest["frames"])
+    gc_policy.report()
+    cbHandler.finish()
+    cbHandler.write_map()
+    finish_cache(cache_dir, image_name, manifest)
+
+
+def report_first_frame(start_time_ms):
+    if start_time_ms is not None:
+        print("time to first frame: %d ms" % utime.ticks_diff(utime.ticks_ms(), start_time_ms))
+
+
+# what FrameScheduler does with a frame that is ready after its deadline:
+# show it anyway and keep the original deadlines so later frames catch up
+SCHEDULE_CATCH_UP = 0
+# as SCHEDULE_CATCH_UP, but skip sending frames whose successor is already due
+SCHEDULE_DROP = 1
+# show it and move every later deadline back by the lateness
+SCHEDULE_RESYNC = 2
+
+
+class FrameScheduler:
+    """
+    Keeps frames on absolute deadlines: each frame is due when the previous
+    one was due plus the previous one's delay, so sleeping and decoding
+    errors do not add up over a loop.  Lateness of every frame is recorded.
+    """
+
+    # lateness samples kept for the percentile
+    HISTORY = 128
+
+    def __init__(self, policy=SCHEDULE_DROP):
+        self.policy = policy
+        self.deadline = None
+        # delay of the frame on the display, in ms
+        self.delay_ms = 0
+        self.history = array('H', bytes(2 * self.HISTORY))
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.count = 0
+        self.total_late_ms = 0
+        self.max_late_ms = 0
+        self.skipped = 0
+
+    def wait(self, frame_delay):
+        """
+            Sleep until the next frame is due
+        :param frame_delay: the next frame's own delay, in 1/100th second
+        :return: False if the frame should not be sent to the display
+        """
+        ahead = self.ahead(frame_delay)
+        if ahead > 0:
+            utime.sleep_ms(ahead)
+        return ahead >= 0
+
+    @micropython.native
+    def ahead(self, frame_delay):
+        """
+            Move on to the next frame's deadline without sleeping, for
+            players that wait some other way
+        :param frame_delay: the next frame's own delay, in 1/100th second
+        :return: ms until the frame is due, 0 when it is due or late, -1
+            when it should not be sent to the display
+        """
+        now = utime.ticks_ms()
+        ahead = 0
+        if self.deadline is None:
+            late = 0
+            self.deadline = now
         else:
-            print("frame parsing took too long, delta: ", delta_in_ms, "delay: ", delay_in_ms)
+            self.deadline = utime.ticks_add(self.deadline, self.delay_ms)
+            late = utime.ticks_diff(now, self.deadline)
+            if late < 0:
+                ahead = -late
+                late = 0
+            elif late > 0:
+                policy = self.policy
+                if policy == SCHEDULE_RESYNC:
+                    self.deadline = now
+                elif policy == SCHEDULE_DROP and frame_delay and late >= frame_delay * 10:
+                    # the frame after this one is due already
+                    ahead = -1
+                    self.skipped += 1
+        self.delay_ms = frame_delay * 10
+
+        self.history[self.count % self.HISTORY] = late if late < 0xffff else 0xffff
+        self.count += 1
+        self.total_late_ms += late
+        if late > self.max_late_ms:
+            self.max_late_ms = late
+        return ahead
+
+    def stats(self):
+        """
+        :return: (frames, mean ms late, 95th percentile ms late, max ms late, frames not shown)
+        """
+        if not self.count:
+            return 0, 0, 0, 0, 0
+        return (self.count, self.total_late_ms / self.count, perf.percentile(self.history, self.count),
+                self.max_late_ms, self.skipped)
+
+    def report(self):
+        print("frame timing: %d frames, late mean %.1f ms, p95 %d ms, max %d ms, %d not shown" % self.stats())
+
+
+def merge_region(pending, changed):
+    """
+        Combine the regions of a frame that was not shown and the next one
+    :param pending: region still to be sent, SHOW_ALL or SHOW_NOTHING
+    :param changed: region of the next frame
+    :return: region covering both
+    """
+    if pending is SHOW_NOTHING:
+        return changed
+    if changed is SHOW_NOTHING:
+        return pending
+    if pending is SHOW_ALL or changed is SHOW_ALL:
+        return SHOW_ALL
+    return (min(pending[0], changed[0]), min(pending[1], changed[1]),
+            max(pending[2], changed[2]), max(pending[3], changed[3]))
+
+
+def display_screen(oled):
+    """
+        The part of the driver's buffer that holds pixels, the I2C driver
+        keeps a control byte in front of them
+    """
+    buffer = oled.buffer
+    return memoryview(buffer)[len(buffer) - DISPLAY_BUFFER_SIZE:]
+
+
+# used when gc.mem_free() is not available to size the frame cache
+DEFAULT_FRAME_CACHE_BUDGET = 65536
+
+
+class FrameCache:
+    """
+    Frames kept in RAM once they have been read, so later loops skip the
+    filesystem.  An entry holds what gets copied into the display buffer:
+    the whole display for a keyframe, only the changed spans for a delta
+    frame.  Once the budget is used up no more frames are kept: frames are
+    played in a loop, so making room by dropping one would only move the
+    miss to the frame dropped, and allocate and free a copy every frame.
+    """
+
+    # rough cost of an entry besides its payload
+    ENTRY_OVERHEAD = 64
+
+    def __init__(self, budget=None):
+        """
+        :param budget: bytes to use, defaults to half of the free heap
+        """
+        if budget is None:
+            budget = mem_free() // 2 if mem_free else DEFAULT_FRAME_CACHE_BUDGET
+        self.budget = budget
+        self.used = 0
+        # key -> [encoding, payload memoryview, length, delay, region]
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        # frames that did not fit
+        self.full = 0
+
+    @micropython.native
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, encoding, payload, length, delay, region):
+        """
+            Keep a copy of a frame, when it fits in what is left of the budget
+        :param key: frame number, 0 for the loop frame
+        :param encoding: ENCODING_PAGES or ENCODING_DELTA
+        :param payload: bytes to copy into the display buffer, or the spans
+        :param region: region to show, SHOW_ALL or SHOW_NOTHING
+        :return:
+        """
+        size = length + self.ENTRY_OVERHEAD
+        if self.used + size > self.budget:
+            self.full += 1
+            return
+        if region is not SHOW_ALL and region is not SHOW_NOTHING:
+            region = tuple(region)
+        self.entries[key] = [encoding, memoryview(bytearray(payload[:length])), length, delay, region]
+        self.used += size
+
+    def report(self):
+        print("frame cache: %d hits, %d misses, %d did not fit, %d frames, %d of %d bytes" % (
+            self.hits, self.misses, self.full, len(self.entries), self.used, self.budget))
+
 
 @micropython.native
-def show_gif_frames(image_map, cache_dir, image_name):
-    global _oled
+class FrameDecoder:
+    """
+    Reads the cached frames in order, looping forever, and draws each one
+    into a display buffer
+    """
 
-    pixel = _oled.framebuf.pixel
+    def __init__(self, pack, screen, fb, frame_cache=None):
+        """
+        :param pack: FramePack of the cache
+        :param screen: display buffer the frames are drawn into
+        :param fb: framebuf.FrameBuffer drawing into screen
+        :param frame_cache: FrameCache to keep frames in RAM, None reads every frame from flash
+        """
+        self.pack = pack
+        self.screen = screen
+        self.fb = fb
+        self.frame_cache = frame_cache
+        self.segments = MapSegments(pack.image_map(), pack)
+        self.reader = FrameReader()
+        self.region = [0, 0, 0, 0]
+        self.has_loop_file = pack.has_loop
+        self.looped = False
+        self.frame_count = pack.frame_count
+        # number of the frame next() decoded last
+        self.index = 0
+        # frame cache key of the frame read
+        self.key = 0
+        # frame cache entry read() found
+        self.cached = None
+        self.delay = 0
+        self.changed = SHOW_NOTHING
 
-    play_delay = None
-    prev_play_delay = None
-    frame_start_time = None
+    def next(self):
+        """
+            Draw the next frame
+        :return: (delay, changed) with changed the region of the display
+            that differs from the frame before, SHOW_ALL or SHOW_NOTHING
+        """
+        prof = perf.recorder()
+        if prof is not None:
+            start = utime.ticks_us()
+        codec = self.read()
+        if prof is not None:
+            start = prof.lap('read', start)
+        if codec is None:
+            self.draw_cached()
+        else:
+            codec.decode(self.reader, self.screen, self.fb, self.segments)
+            self.drawn(codec)
+        if prof is not None:
+            prof.lap('decode', start)
+        return self.delay, self.changed
 
-    image_frame_index = 1
-    while True:
-        image_file_name = "%s_%d.bin" % ("/".join((cache_dir, image_name)), image_frame_index)
-        try:
-            # see if the file exists
-            mode = os.stat(image_file_name)[0]
-        except OSError:
-            # there are no more *_n.bin files left, reset and start from the beginning
+    def read(self):
+        """
+            Move on to the next frame and read it, unless it is in the frame cache
+        :return: the codec to draw the frame in self.reader with, then call
+            drawn(); None when the frame is in self.cached, for draw_cached()
+        """
+        frame_cache = self.frame_cache
+        image_frame_index = self.index + 1
+        if image_frame_index > self.frame_count:
             image_frame_index = 1
-            sleep_remaining_frame_delay_time(frame_start_time, play_delay)
-            continue
+            self.looped = True
 
-        prev_play_delay = play_delay
+        if image_frame_index == 1 and self.looped and self.has_loop_file:
+            # delta back to frame 1 instead of the full keyframe
+            key = 0
+        else:
+            key = image_frame_index
 
-        f = open(image_file_name, "r")
-        play_delay, width, height, top_left_x, top_left_y, image_data = json.load(f)
-        f.close()
+        self.index = image_frame_index
+        cached = frame_cache.get(key) if frame_cache is not None else None
+        if cached is not None:
+            self.cached = cached
+            return None
+        self.key = key
+
+        reader = self.reader
+        # page frames land directly in the display buffer
+        self.pack.read_frame(reader, key, self.screen)
+        self.delay = reader.delay
+        return CODECS[reader.encoding]
+
+    def draw_cached(self):
+        encoding, payload, length, delay, changed = self.cached
+        self.cached = None
+        if encoding == ENCODING_DELTA:
+            apply_delta(self.screen, payload, length)
+        else:
+            self.screen[:] = payload
+        self.delay = delay
+        self.changed = changed
+
+    def drawn(self, codec):
+        """
+            Work out what the frame codec drew changed, and keep it in the frame cache
+        """
+        reader = self.reader
+        # after looping the whole display differs from the last frame,
+        # otherwise only send what changed: the frame's rectangle, or
+        # for deltas the spans, nothing at all for a repeated frame
+        changed = codec.region(reader, self.region, self.index == 1)
+        self.changed = changed
+
+        frame_cache = self.frame_cache
+        if frame_cache is not None:
+            encoding = reader.encoding
+            if encoding == ENCODING_DELTA:
+                frame_cache.put(self.key, encoding, reader.payload, reader.length, self.delay, changed)
+            else:
+                frame_cache.put(self.key, ENCODING_PAGES, self.screen, DISPLAY_BUFFER_SIZE, self.delay, changed)
+
+
+def show_gif_frames(pack, start_time_ms=None, frame_cache=None, scheduler=None, background=False):
+    """
+        Play the cached frames forever
+    :param pack: FramePack of the cache, see open_cache()
+    :param start_time_ms: ticks_ms() when run() started, to report time to first frame
+    :param frame_cache: FrameCache to keep frames in RAM, None reads every frame from flash
+    :param scheduler: FrameScheduler, one that already timed the frame on the
+        display carries on from it
+    :param background: decode each frame on a second thread while the one
+        before it is shown, see background.BackgroundDecoder
+    """
+    global _oled
+
+    screen = display_screen(_oled)
+    if background:
+        from background import BackgroundDecoder
+        decoder = BackgroundDecoder(pack, screen, frame_cache)
+    else:
+        decoder = FrameDecoder(pack, screen, _oled.framebuf, frame_cache)
+
+    if scheduler is None:
+        scheduler = FrameScheduler()
+    # region of frames the scheduler did not let through to the display yet
+    pending = SHOW_NOTHING
+    # per frame read, decode, sleep and show timings
+    prof = perf.recorder()
+    reported_misses = 0
 
-        current_x = top_left_x
-        current_y = top_left_y
-
-        max_x = top_left_x + width
-
-        # decompress the image data into a 0-based buffer
-        for data_index in image_data:
-            for entry in image_map[data_index]:
-                if isinstance(entry, int):
-                    pixel(127-current_y, current_x, (entry & 0x80)>>7)
-                    current_x += 1
-                    if current_x >= max_x:
-                        current_x = top_left_x
-                        current_y += 1
-
-                    pixel(127-current_y, current_x, (entry & 0x40)>>6)
-                    current_x += 1
-                    if current_x >= max_x:
-                        current_x = top_left_x
-                        current_y += 1
-
-                    pixel(127-current_y, current_x, (entry & 0x20)>>5)
-                    current_x += 1
-                    if current_x >= max_x:
-                        current_x = top_left_x
-                        current_y += 1
-
-                    pixel(127-current_y, current_x, (entry & 0x10)>>4)
-                    current_x += 1
-                    if current_x >= max_x:
-                        current_x = top_left_x
-                        current_y += 1
-
-                    pixel(127-current_y, current_x, (entry & 0x08)>>3)
-                    current_x += 1
-                    if current_x >= max_x:
-                        current_x = top_left_x
-                        current_y += 1
-
-                    pixel(127-current_y, current_x, (entry & 0x04)>>2)
-                    current_x += 1
-                    if current_x >= max_x:
-                        current_x = top_left_x
-                        current_y += 1
-
-                    pixel(127-current_y, current_x, (entry & 0x02)>>1)
-                    current_x += 1
-                    if current_x >= max_x:
-                        current_x = top_left_x
-                        current_y += 1
-
-                    pixel(127-current_y, current_x, (entry & 0x01))
-                    current_x += 1
-                    if current_x >= max_x:
-                        current_x = top_left_x
-                        current_y += 1
-                else:
-                    for item in entry:
-                        pixel(127-current_y, current_x, 1 if item else 0)
-                        current_x += 1
-                        if current_x >= max_x:
-                            current_x = top_left_x
-                            current_y += 1
-
-        sleep_remaining_frame_delay_time(frame_start_time, prev_play_delay)
-        prev_Play_delay = None
-        frame_start_time = utime.ticks_ms()
-
-        _oled.show() # this takes ~40ms to complete
-
-        image_frame_index += 1
-
-
-def load_gif_image_map(cache_dir, image_name):
     try:
-        f = open("%s.map" % ("/".join((cache_dir, image_name))), "r")
-        image_map = json.load(f)
-        f.close()
-        return image_map
-    except:
-        print("%s gif image map not found:", image_name, "(expected on first run)")
+        while True:
+            delay, changed = decoder.next()
+            if decoder.index == 1 and decoder.looped:
+                scheduler.report()
+                if frame_cache is not None and frame_cache.misses != reported_misses:
+                    frame_cache.report()
+                    reported_misses = frame_cache.misses
+                if prof is not None:
+                    prof.dump_csv()
+
+            if pending is not SHOW_NOTHING:
+                changed = merge_region(pending, changed)
+
+            if prof is not None:
+                start = utime.ticks_us()
+            show = scheduler.wait(delay)
+            if prof is not None:
+                start = prof.lap('sleep', start)
+            if not show:
+                # running late, send it together with the next frame; the
+                # region list is refilled by the next frame
+                pending = changed if changed is SHOW_ALL else tuple(changed)
+                continue
+            pending = SHOW_NOTHING
+
+            if changed is SHOW_ALL:
+                _oled.show() # this takes ~40ms to complete
+                if not decoder.looped:
+                    report_first_frame(start_time_ms)
+            elif changed is not SHOW_NOTHING:
+                _oled.show(changed)
+            if prof is not None:
+                prof.lap('show', start)
+    finally:
+        if background:
+            decoder.stop()
+
+
+def make_frame_cache(budget):
+    if budget == 0:
         return None
+    # measure the free heap after the image map has been loaded
+    collect()
+    return FrameCache(budget)
+
 
 def init_display():
     global _oled
@@ -192,27 +959,64 @@ def init_display():
     _oled = ssd1306.SSD1306_I2C(128, 64, i2c)
 
 
-def run(image_name):
+def run(image_name, single_pass=False, frame_cache_budget=None, schedule_policy=SCHEDULE_DROP,
+        background_decode=False, flash_budget=None):
+    """
+        Play image_name.gif, building its frame cache first if there is none,
+        or carrying on with or redoing one that is unfinished or out of date
+    :param single_pass: when the cache has to be built, show the frames while
+        they are decoded and go straight on to playing from the cache, instead
+        of building the whole cache and resetting the device to free memory
+    :param frame_cache_budget: bytes of RAM for keeping played frames, defaults
+        to half of the free heap, 0 reads every frame from flash
+    :param schedule_policy: what to do with frames decoded after their
+        deadline, SCHEDULE_CATCH_UP, SCHEDULE_DROP or SCHEDULE_RESYNC
+    :param background_decode: decode the next frame on a second thread while
+        the current one is shown, needs _thread
+    :param flash_budget: bytes all the cache_<image_name> directories may
+        use together; before a build, the caches played longest ago are
+        removed to stay within it and within the free space, see
+        cachemanager.CacheManager.  None keeps every cache
+    """
+    start_time_ms = utime.ticks_ms()
     base_cache_dir = 'cache'
     cache_dir = "_".join((base_cache_dir, image_name))
 
     init_display()
 
-    try:
-        mode = os.stat(cache_dir)[0]
-        if stat.S_ISDIR(mode):
-            try:
-                _image_map = load_gif_image_map(cache_dir, image_name)
-                show_gif_frames(_image_map, cache_dir, image_name)
-            except:
-                print("fatal error loading image cache files")
-                raise
-        else:
-            print("fatal error: cache dir was found, but is not a directory")
-    except:
-        # cache directory doesn't exist, create it and generate the pre-parsed frame files
-        os.mkdir(cache_dir)
-        create_gif_image_files(cache_dir, image_name)
+    caches = None
+    if flash_budget is not None:
+        from cachemanager import CacheManager
+        caches = CacheManager(flash_budget)
+        caches.play(image_name)
+    status, manifest = prepare_cache(cache_dir, image_name)
+    if status == CACHE_READY:
+        try:
+            show_gif_frames(open_cache(cache_dir, image_name), start_time_ms,
+                            frame_cache=make_frame_cache(frame_cache_budget),
+                            scheduler=FrameScheduler(schedule_policy), background=background_decode)
+        except:
+            print("fatal error loading image cache files")
+            raise
+    else:
+        if caches is not None:
+            fits = caches.make_room(image_name)
+            caches.report()
+            if not fits:
+                # a build that runs out of space halfway helps nobody
+                raise OSError("not enough flash for the frame cache of %s" % image_name)
+        # generate the pre-parsed frame files, carrying on from an interrupted build
+        if single_pass:
+            scheduler = FrameScheduler(schedule_policy)
+            play_while_creating_gif_image_files(cache_dir, image_name, start_time_ms, scheduler, manifest)
+            # the parser's memory is garbage now, later loops come from the cache
+            collect()
+            show_gif_frames(open_cache(cache_dir, image_name),
+                            frame_cache=make_frame_cache(frame_cache_budget), scheduler=scheduler,
+                            background=background_decode)
+            return
+        create_gif_image_files(cache_dir, image_name, manifest=manifest)
+        print("frame cache built in %d ms" % utime.ticks_diff(utime.ticks_ms(), start_time_ms))
         # let the OS finish writing files
         utime.sleep(1)
         # at this point, the cache directory should be fully populated
@@ -2,79 +2,152 @@ import binascii
 import os
 import struct
 import copy
+import sys
+from array import array
 from gc import collect
+try:
+    from gc import mem_free
+except ImportError:
+    # CPython
+    mem_free = None
+import perf
+
+
+# GIF codes are at most 12 bits wide
+MAX_CODES = 4096
+
+
+class GCPolicy:
+    """
+    Decides when the parser runs gc.collect()
+
+    The LZW loop calls check() every interval codes.  A collection runs when
+    gc.mem_free() is below min_free, or unconditionally once every codes
+    have gone by since the last one.  MicroPython also collects by itself
+    when an allocation fails, this only keeps the heap from fragmenting
+    before that.  Where there is no gc.mem_free(), as on CPython, only
+    every applies.
+    """
+
+    def __init__(self, min_free=16384, every=None, interval=64):
+        self.min_free = min_free
+        self.every = every
+        self.interval = interval
+        self.codes = 0
+        self.collections = 0
+        self.collect_us = 0
+
+    def check(self):
+        """
+            Called by the parser after another interval LZW codes
+        :return:
+        """
+        self.codes += self.interval
+        if self.every is not None and self.codes >= self.every:
+            self.collect()
+        elif self.min_free is not None and mem_free is not None and mem_free() < self.min_free:
+            self.collect()
+
+    def collect(self):
+        start = perf.ticks_us()
+        collect()
+        self.collect_us += perf.ticks_diff(perf.ticks_us(), start)
+        self.collections += 1
+        self.codes = 0
+
+    def report(self):
+        print("gc: %d collections, %d ms" % (self.collections, self.collect_us // 1000))
 
 
 class Table:
     """
     Table for LZW codes
+
+    Every code past the end code is stored as the code of its prefix string
+    plus one final symbol, so adding a code never copies a string.  The first
+    symbol and the length are kept as well so neither needs a walk of the
+    prefix chain.  The arrays are sized for the 4096 code GIF limit once and
+    are reused after each clear code.
     """
 
     def __init__(self, size):
-        self.table = [[i] for i in range(size)]
         self.clear_value = size
-        self.table.append([size])
         self.end_value = size + 1
-        self.table.append([size + 1])
+        self.prefix = array('H', bytes(2 * MAX_CODES))
+        self.suffix = array('B', bytes(MAX_CODES))
+        self.first = array('B', bytes(MAX_CODES))
+        self.length = array('H', bytes(2 * MAX_CODES))
+        for i in range(size):
+            self.suffix[i] = i
+            self.first[i] = i
+            self.length[i] = 1
+        self.size = 0
+        self.reset()
+
+    def reset(self):
+        """
+            Forget every code added since the last clear code
+        :return:
+        """
+        self.size = self.end_value + 1
 
     @micropython.native
-    def add(self, value):
+    def add(self, prefix, symbol):
         """
-            Add value to table if it's not exists
-        :param value:
+            Add the code for the string of prefix followed by symbol
+        :param prefix: code of the string without its last symbol
+        :param symbol: last symbol of the string
         :return:
         """
-        #print("!!! Table.add - value: ", value)
-        compressed_value = []
-        compressed_index = 0
-        for i in range(0,int(len(value) / 8)):
-            offset = i * 8
-            byte = (
-                0x80 * value[offset] + 
-                0x40 * value[offset+1] + 0x20 * value[offset+2] + 0x10 * value[offset+3] + 
-                0x08 * value[offset+4] + 0x04 * value[offset+5] + 
-                0x02 * value[offset+6] + value[offset+7])
-            compressed_value.append(byte)
-        if len(value) % 8 > 0:
-            compressed_value.append(value[-(len(value) % 8):])
-
-        #print("!!! Table.add - compressed value: ", compressed_value)
-
-        found = False
-        for i in range(self.end_value + 1, len(self.table)):
-            entry = self.table[i]
-            if entry == compressed_value:
-                found = True
-                break
-
-        if not found:
-            self.table.append(compressed_value)
+        size = self.size
+        if size < MAX_CODES:
+            self.prefix[size] = prefix
+            self.suffix[size] = symbol
+            self.first[size] = self.first[prefix]
+            self.length[size] = self.length[prefix] + 1
+            self.size = size + 1
 
     @micropython.native
     def get_value(self, index):
-        if index <= self.end_value:
-            return self.table[index]
-
-        value = []
-        for entry in self.table[index]:
-            if isinstance(entry, int):
-                value.append((entry & 0x80)>> 7)
-                value.append((entry & 0x40)>> 6)
-                value.append((entry & 0x20)>> 5)
-                value.append((entry & 0x10)>> 4)
-                value.append((entry & 0x08)>> 3)
-                value.append((entry & 0x04)>> 2)
-                value.append((entry & 0x02)>> 1)
-                value.append((entry & 0x01))
-            else:
-                value = value + entry
+        """
+            Expand a code into its string of symbols
+        :param index: code
+        :return: bytearray of symbols
+        """
+        prefix = self.prefix
+        suffix = self.suffix
+        i = self.length[index]
+        value = bytearray(i)
+        while i > 1:
+            i -= 1
+            value[i] = suffix[index]
+            index = prefix[index]
+        value[0] = suffix[index]
         return value
 
+    @micropython.native
     def get_raw_value(self, index):
-        return self.table[index]
+        """
+            Expand a code into its packed form: whole bytes of 8 symbols,
+            followed by a list with the remaining symbols
+        :param index: code
+        :return: list
+        """
+        value = self.get_value(index)
+        length = len(value)
+        whole = length & ~7
+        raw = []
+        for offset in range(0, whole, 8):
+            byte = 0
+            for i in range(offset, offset + 8):
+                byte = (byte << 1) | (1 if value[i] else 0)
+            raw.append(byte)
+        if whole < length:
+            raw.append(list(value[whole:]))
+        return raw
 
     def get_size(self):
-        return len(self.table)
+        return self.size
 
     def is_clear(self, value):
         return value == self.clear_value
@@ -83,7 +156,6 @@ class Table:
         return value == self.end_value
 
 
-
 class Color:
     def __init__(self, r, g, b):
         #super(Color, self).__init__()
@@ -119,6 +191,238 @@ def byte_to_bits(b):
     fstr = bin(ord(b))[2:]
     return "%s%s" % ("0" * (8 - len(fstr)), fstr)
 
+
+class BitReader:
+    """
+    Reads variable width LZW codes from GIF image data
+
+    GIF packs codes least significant bit first, so the next code is always
+    the low bits of an integer accumulator that is refilled a byte at a time.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.end = len(data)
+        self.acc = 0
+        self.bits = 0
+
+    @micropython.native
+    def read(self, width):
+        """
+            Read the next code
+        :param width: code width in bits (3-12)
+        :return: code, or -1 when the data ends before a whole code is read
+        """
+        acc = self.acc
+        bits = self.bits
+        while bits < width:
+            if self.pos >= self.end and not self.refill():
+                self.acc = acc
+                self.bits = bits
+                return -1
+            acc |= self.data[self.pos] << bits
+            self.pos += 1
+            bits += 8
+        self.acc = acc >> width
+        self.bits = bits - width
+        return acc & ((1 << width) - 1)
+
+    def refill(self):
+        """
+            Called when data is used up
+        :return: True if more data was loaded into data[pos:end]
+        """
+        return False
+
+
+# MicroPython's readinto takes a byte count, CPython needs a sliced memoryview
+_readinto_sized = sys.implementation.name == 'micropython'
+
+
+class SubBlockReader(BitReader):
+    """
+    BitReader that pulls image data straight from the GIF stream
+
+    Each 1-255 byte data sub-block is read into the same buffer when the
+    previous one is used up, so memory use does not depend on how much
+    compressed data a frame has.
+    """
+
+    def __init__(self, stream, buffer=None):
+        if buffer is None:
+            buffer = bytearray(255)
+        super().__init__(buffer)
+        self.stream = stream
+        self.view = memoryview(buffer)
+        self.length = bytearray(1)
+        self.end = 0
+        self.done = False
+
+    def start(self):
+        """
+            Start on the next frame's sub-blocks, reusing the buffer
+        :return:
+        """
+        self.pos = 0
+        self.end = 0
+        self.acc = 0
+        self.bits = 0
+        self.done = False
+
+    def refill(self):
+        if self.done:
+            return False
+        stream = self.stream
+        if stream.readinto(self.length) != 1:
+            raise ValueError("GIF data ends in the middle of a frame")
+        length = self.length[0]
+        if length == 0:
+            # block terminator
+            self.done = True
+            return False
+        if _readinto_sized:
+            count = stream.readinto(self.data, length)
+        else:
+            count = stream.readinto(self.view[:length])
+        if count != length:
+            raise ValueError("GIF data ends in the middle of a frame")
+        self.pos = 0
+        self.end = length
+        return True
+
+    def skip(self):
+        """
+            Move the stream past the rest of the frame's sub-blocks
+        :return:
+        """
+        while self.refill():
+            pass
+
+
+class TimedSubBlockReader(SubBlockReader):
+    """
+    SubBlockReader adding the time spent reading sub-blocks up in us, only
+    used while perf recording is on
+    """
+
+    def __init__(self, stream, buffer=None):
+        super().__init__(stream, buffer)
+        self.us = 0
+
+    def refill(self):
+        start = perf.ticks_us()
+        more = SubBlockReader.refill(self)
+        self.us += perf.ticks_diff(perf.ticks_us(), start)
+        return more
+
+
+def read_byte(stream):
+    """
+    :return: the next byte of stream as an int
+    """
+    data = stream.read(1)
+    if not data:
+        raise ValueError("GIF data ends early")
+    return data[0]
+
+
+def skip_sub_blocks(stream):
+    """
+        Seek past a frame's data sub-blocks without reading them
+    :return:
+    """
+    length = read_byte(stream)
+    while length:
+        stream.seek(length, 1)
+        length = read_byte(stream)
+
+
+def entry_key(image_item):
+    """
+    :param image_item: packed entry from Table.get_raw_value
+    :return: hashable copy of the entry
+    """
+    if image_item and not isinstance(image_item[-1], int):
+        return bytes(image_item[:-1]), bytes(image_item[-1])
+    return bytes(image_item), b''
+
+
+class ImageMap:
+    """
+    Unique LZW table entries shared by every frame of a GIF
+
+    entries keeps the packed form written to the cache, index maps a hashable
+    copy of each entry to its position so lookups do not scan the list.
+    bytes counts the packed bytes and leftover symbols of all entries.  add()
+    never refuses an entry, is_full() tells the cache writer when the map
+    went past max_entries or max_bytes so it can truncate() it.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.entries = []
+        self.index = {}
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # time spent in timed_add
+        self.add_us = 0
+
+    @micropython.native
+    def add(self, image_item):
+        """
+            Find image_item, adding it when it is new
+        :param image_item: packed entry from Table.get_raw_value
+        :return: position of the entry in entries
+        """
+        key = entry_key(image_item)
+        found_index = self.index.get(key)
+        if found_index is None:
+            found_index = len(self.entries)
+            self.entries.append(image_item)
+            self.index[key] = found_index
+            self.bytes += len(key[0]) + len(key[1])
+            self.misses += 1
+        else:
+            self.hits += 1
+        return found_index
+
+    def timed_add(self, image_item):
+        """
+            add(), adding the time it takes up in add_us
+        """
+        start = perf.ticks_us()
+        found_index = self.add(image_item)
+        self.add_us += perf.ticks_diff(perf.ticks_us(), start)
+        return found_index
+
+    def is_full(self):
+        """
+        :return: True once there are more than max_entries entries or more than max_bytes bytes
+        """
+        if self.max_entries is not None and len(self.entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.bytes > self.max_bytes
+
+    def truncate(self, size):
+        """
+            Drop every entry from position size on
+        :return: list of the dropped entries
+        """
+        removed = self.entries[size:]
+        del self.entries[size:]
+        for image_item in removed:
+            key = entry_key(image_item)
+            del self.index[key]
+            self.bytes -= len(key[0]) + len(key[1])
+        return removed
+
+    def get_size(self):
+        return len(self.entries)
+
+
 class GiPyF:
     def __init__(self):
         # Gif standart version GIF89a or GIF87a
@@ -142,23 +446,38 @@ class GiPyF:
         self.background = b'00'
         self.width_to_height = b'00'
 
-        self.image_map_list = []
+        # image_map_list is image_map.entries, kept for callers reading it directly
+        self.image_map = ImageMap()
+        self.image_map_list = self.image_map.entries
 
         self.frames_count = 0
 
-    def parse(self, source, image_callback, gce_callback):
+    def parse(self, source, image_callback, gce_callback, streaming=True, gc_policy=None, packed=False,
+              skip_frames=0, skip_callback=None):
         """
         Prepare GiPyF object from gif's binary data
         :param source: string path to file
+        :param streaming: decode image data as it is read from source instead
+            of reading each frame's data into memory first
+        :param gc_policy: GCPolicy deciding when to collect while decoding,
+            defaults to GCPolicy()
+        :param packed: decode each frame into image.pixels with
+            Image.unpack_pixels, the image map stays empty
+        :param skip_frames: frames at the start to seek past without
+            decoding them or calling image_callback, they are still counted
+        :param skip_callback: called with (frame number, top left x, top
+            left y, width, height) for each frame skipped
         :return:
         """
+        if gc_policy is None:
+            gc_policy = GCPolicy()
         stream = source
         if type(source) == str:
             stream = open(source, 'rb')
 
         self.version = stream.read(6).decode()
-        self.width = struct.unpack('<BB', stream.read(2))[0]
-        self.height = struct.unpack('<BB', stream.read(2))[0]
+        self.width = struct.unpack('<H', stream.read(2))[0]
+        self.height = struct.unpack('<H', stream.read(2))[0]
 
         header_bit_data = byte_to_bits(stream.read(1))
         self.is_global_color_table = int(header_bit_data[0]) == 1
@@ -177,14 +496,26 @@ class GiPyF:
             pos += 3
 
         # performance for micropython - use local variable
-        image_map_list = self.image_map_list
+        image_map = self.image_map
+        # one LZW table for every frame, its arrays are allocated once
+        lzw_table = None
+        # per frame bits (sub-block reading), lzw and dedup (image map) timings
+        prof = perf.recorder()
+        sub_block_reader = None
+        if streaming:
+            sub_block_reader = SubBlockReader(stream) if prof is None else TimedSubBlockReader(stream)
 
         part_marker = stream.read(1)
-        while ord(part_marker) != 0x3b:  # End of blocks
+        while part_marker != b'\x3b':  # End of blocks
+            if not part_marker:
+                raise ValueError("GIF data ends before its trailer")
             if ord(part_marker) == 0x21:  # Extension block
-                extension_type = ord(stream.read(1))
+                extension_type = read_byte(stream)
                 if extension_type == 0xf9:  # Graphics control extension
-                    data = stream.read(struct.unpack('<B', stream.read(1))[0])
+                    length = read_byte(stream)
+                    data = stream.read(length)
+                    if len(data) != length or length < 3:
+                        raise ValueError("GIF data ends early")
                     color_alpha_index = struct.unpack('<B', data[-1:])[0]
                     play_delay = (
                         struct.unpack('<B', data[-3:-2])[0],
@@ -194,34 +525,69 @@ class GiPyF:
                     gce_callback(color_alpha_index, play_delay)
                 else:
                     # Skip unsupported blocks
-                    block_length = struct.unpack('<B', stream.read(1))[0]
+                    block_length = read_byte(stream)
                     while block_length != 0:
                         stream.read(block_length)
-                        block_length = struct.unpack('<B', stream.read(1))[0]
+                        block_length = read_byte(stream)
             elif ord(part_marker) == 0x2c:  # Image block
-                top_left_x = struct.unpack('<BB', stream.read(2))[0]
-                top_left_y = struct.unpack('<BB', stream.read(2))[0]
+                descriptor = stream.read(9)
+                if len(descriptor) != 9:
+                    raise ValueError("GIF data ends early")
+                top_left_x, top_left_y, width, height = struct.unpack('<HHHH', descriptor[:8])
 
-                width = struct.unpack('<BB', stream.read(2))[0]
-                height = struct.unpack('<BB', stream.read(2))[0]
+                local_color_table = descriptor[8:]
 
-                local_color_table = stream.read(1)
+                lzw_length = read_byte(stream) + 1
 
-                lzw_length = struct.unpack('<B', stream.read(1))[0] + 1
+                if self.frames_count < skip_frames:
+                    skip_sub_blocks(stream)
+                    self.frames_count += 1
+                    if skip_callback is not None:
+                        skip_callback(self.frames_count, top_left_x, top_left_y, width, height)
+                    part_marker = stream.read(1)
+                    continue
 
                 image = Image(width, height, lzw_length, self.global_palete, top_left_x=top_left_x,
                               top_left_y=top_left_y,
                               local_color_table=local_color_table, debug=False)
 
-                # Collect all image binary in one
-                parts = b''
-                length = struct.unpack('<B', stream.read(1))[0]
-                while length != 0:
-                    parts += stream.read(length)
-                    length = struct.unpack('<B', stream.read(1))[0]
-
-                image.set_binary_data(parts)
-                image.unpack_binary_data(image_map_list)
+                if lzw_table is None or lzw_table.clear_value != 1 << (lzw_length - 1):
+                    lzw_table = Table(1 << (lzw_length - 1))
+
+                if prof is not None:
+                    image_map.add_us = 0
+                    start = perf.ticks_us()
+                if streaming:
+                    sub_block_reader.start()
+                    if prof is not None:
+                        sub_block_reader.us = 0
+                    if packed:
+                        image.unpack_pixels(lzw_table, sub_block_reader, gc_policy)
+                    else:
+                        image.unpack_binary_data(image_map, lzw_table, sub_block_reader, prof is not None, gc_policy)
+                    sub_block_reader.skip()
+                    if prof is not None:
+                        bits_us = sub_block_reader.us
+                else:
+                    # Collect all image binary in one
+                    parts = bytearray()
+                    length = read_byte(stream)
+                    while length != 0:
+                        parts.extend(stream.read(length))
+                        length = read_byte(stream)
+
+                    image.set_binary_data(parts)
+                    if prof is not None:
+                        bits_us = perf.ticks_diff(perf.ticks_us(), start)
+                    if packed:
+                        image.unpack_pixels(lzw_table, gc_policy=gc_policy)
+                    else:
+                        image.unpack_binary_data(image_map, lzw_table, timed=prof is not None, gc_policy=gc_policy)
+                    del parts
+                if prof is not None:
+                    prof.add('bits', bits_us)
+                    prof.add('dedup', image_map.add_us)
+                    prof.add('lzw', perf.ticks_diff(perf.ticks_us(), start) - bits_us - image_map.add_us)
 
                 self.frames_count += 1
 
@@ -248,116 +614,149 @@ class Image:
 
         self.binary_data = b''
         self.image_data = []
+        # set by unpack_pixels instead of image_data
+        self.pixels = None
 
         self.debug = debug
 
     def set_binary_data(self, data):
         self.binary_data = data
 
-    def unpack_binary_data(self, image_map_list):
+    @micropython.native
+    def unpack_pixels(self, lzw_table=None, reader=None, gc_policy=None):
         """
-            Unpack LZW binary
+            Unpack LZW binary straight into pixels: one bit per pixel of the
+            frame rectangle, row after row, set for every color but index 0.
+            Pixel n is bit n & 7 of byte n >> 3, so a row starting on a
+            multiple of 8 lines up with the display's column bytes.
+        :param lzw_table: Table to decode with, reset before use
+        :param reader: BitReader to take codes from, defaults to one over binary_data
+        :param gc_policy: GCPolicy to check while decoding, None never collects
         :return:
         """
-        result = []
-        prev_block = None
-        lzw_table = Table(self.global_palete.get_size())
+        if lzw_table is None or lzw_table.clear_value != 1 << (self.lzw_length - 1):
+            lzw_table = Table(1 << (self.lzw_length - 1))
+        else:
+            lzw_table.reset()
+        clear_value = lzw_table.clear_value
+        end_value = lzw_table.end_value
         current_lzw_length = self.lzw_length
+        prefix = lzw_table.prefix
+        suffix = lzw_table.suffix
+        length = lzw_table.length
+
+        pixel_count = self.width * self.height
+        pixels = bytearray((pixel_count + 7) >> 3)
+        self.pixels = pixels
+        # bit of the first pixel of the next code
+        position = 0
+
+        if reader is None:
+            reader = BitReader(self.binary_data)
+        read = reader.read
+        prev_block = -1
+        gc_countdown = gc_policy.interval if gc_policy is not None else -1
+        while True:
+            gc_countdown -= 1
+            if gc_countdown == 0:
+                gc_policy.check()
+                gc_countdown = gc_policy.interval
+
+            if lzw_table.size >= 1 << current_lzw_length and current_lzw_length < 12:
+                current_lzw_length += 1
 
-        image_data = self.image_data
-        binary_data = self.binary_data
-
-        pos = 7
-        dataByte = 0
-        cByte = byte_to_bits(binary_data[dataByte:dataByte + 1])
-        block = None
-        while dataByte < len(binary_data) - 1:
-            collect()
+            block = read(current_lzw_length)
+            if block < 0 or block == end_value:
+                break
 
-            readbits_result = []
+            if block == clear_value:
+                lzw_table.reset()
+                current_lzw_length = self.lzw_length
+                prev_block = -1
+                continue
+
+            if prev_block >= 0:
+                if block < lzw_table.size:
+                    lzw_table.add(prev_block, lzw_table.first[block])
+                elif block == lzw_table.size:
+                    lzw_table.add(prev_block, lzw_table.first[prev_block])
+                else:
+                    raise ValueError("invalid LZW code %d" % block)
+            elif block >= lzw_table.size:
+                raise ValueError("invalid LZW code %d" % block)
+            prev_block = block
+
+            # the prefix chain gives the string last symbol first
+            end = position + length[block]
+            bit = end - 1
+            code = block
+            while bit >= position:
+                if suffix[code] and bit < pixel_count:
+                    pixels[bit >> 3] |= 1 << (bit & 7)
+                code = prefix[code]
+                bit -= 1
+            position = end
+
+    def unpack_binary_data(self, image_map, lzw_table=None, reader=None, timed=False, gc_policy=None):
+        """
+            Unpack LZW binary
+        :param image_map: ImageMap shared by all frames, image_data holds
+            indexes into its entries
+        :param lzw_table: Table to decode with, reset before use
+        :param reader: BitReader to take codes from, defaults to one over binary_data
+        :param timed: add the image map lookup time up in image_map.add_us
+        :param gc_policy: GCPolicy to check while decoding, None never collects
+        :return:
+        """
+        if lzw_table is None or lzw_table.clear_value != 1 << (self.lzw_length - 1):
+            lzw_table = Table(1 << (self.lzw_length - 1))
+        else:
+            lzw_table.reset()
+        clear_value = lzw_table.clear_value
+        end_value = lzw_table.end_value
+        current_lzw_length = self.lzw_length
 
-            if lzw_table.get_size() >= pow(2, current_lzw_length) and current_lzw_length < 12:
+        image_data = self.image_data
+        add_image_item = image_map.timed_add if timed else image_map.add
+        if reader is None:
+            reader = BitReader(self.binary_data)
+        read = reader.read
+        prev_block = -1
+        # codes left until the next gc_policy check
+        gc_countdown = gc_policy.interval if gc_policy is not None else -1
+        while True:
+            gc_countdown -= 1
+            if gc_countdown == 0:
+                gc_policy.check()
+                gc_countdown = gc_policy.interval
+
+            if lzw_table.size >= 1 << current_lzw_length and current_lzw_length < 12:
                 current_lzw_length += 1
 
-            for k in range(current_lzw_length):
-                readbits_result.insert(0, cByte[pos])
-                pos -= 1
-                if pos < 0:
-                    pos = 7
-                    dataByte += 1
-                    if len(binary_data) - dataByte == 0:
-                        for ap in range(current_lzw_length - k):
-                            readbits_result.insert(0, 0)
-
-                        break
-                    else:
-                        cByte = byte_to_bits(binary_data[dataByte:dataByte + 1])
-
-            block = int("".join([str(i) for i in readbits_result]), 2)
+            block = read(current_lzw_length)
+            if block < 0 or block == end_value:
+                # no end code is tolerated, keep whatever was decoded
+                break
 
             if self.debug:
                 print("unpack_binary_data, block:", block)
 
-            if not lzw_table.is_end(block):
-
-                if self.debug:
-                    print("unpack_binary_data - 1")
-
-                if not lzw_table.is_clear(block):
-                    if block == lzw_table.get_size():
-                        ref = lzw_table.get_value(result[-1])[:]
-                        ref.append(ref[0])
-                        lzw_table.add(ref)
-
-                    if self.debug:
-                        print("unpack_binary_data - 2")
-
-                    result.append(block)
-
-                    if prev_block is not None:
-                        add = prev_block[:]
-                        add.append(lzw_table.get_value(block)[0])
-                        lzw_table.add(add)
-
-                        if self.debug:
-                            print("unpack_binary_data - 3")
-
-
-                    prev_block = lzw_table.get_value(block)[:]
-
-                    if self.debug:
-                        print("unpack_binary_data - 4")
-
+            if block == clear_value:
+                lzw_table.reset()
+                current_lzw_length = self.lzw_length
+                prev_block = -1
+                continue
+
+            if prev_block >= 0:
+                if block < lzw_table.size:
+                    lzw_table.add(prev_block, lzw_table.first[block])
+                elif block == lzw_table.size:
+                    # the code being defined right now, prev_block + its own first symbol
+                    lzw_table.add(prev_block, lzw_table.first[prev_block])
                 else:
-                    lzw_table = Table(self.global_palete.get_size())
-                    current_lzw_length = self.lzw_length
-                    prev_block = None
-                    if self.debug:
-                        print("unpack_binary_data - 5")
-
-            if self.debug:
-                print("unpack_binary_data - 6")
-
-            if lzw_table.is_end(block) or lzw_table.is_clear(block) or dataByte == len(binary_data) - 1:
-                if self.debug:
-                    print("unpack_binary_data - 7, result: ", result)
-                while result:
-                    r = result.pop(0)
-                    image_item = lzw_table.get_raw_value(r)
-                    if r == 0:
-                        image_item = [[0]]
-                    elif r == 1:
-                        image_item = [[1]]
-                    image_found = False
-                    found_index = 0
-                    for i in range(0, len(image_map_list)):
-                        if image_item == image_map_list[i]:
-                            image_found = True
-                            found_index = i
-                            break
-                    if not image_found:
-                        image_map_list.append(image_item)
-                        found_index = len(image_map_list)-1
-
-                    image_data.append(found_index)
+                    raise ValueError("invalid LZW code %d" % block)
+            elif block >= lzw_table.size:
+                raise ValueError("invalid LZW code %d" % block)
+            prev_block = block
 
+            image_data.append(add_image_item(lzw_table.get_raw_value(block)))
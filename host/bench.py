@@ -0,0 +1,279 @@
+"""
+Benchmark suite, results written as JSON to compare between versions
+
+    python3 host/bench.py [-o results.json] [-b baseline.json] [file.gif ...]
+
+Runs fuzzy.gif (or the GIFs given) and a few generated GIFs through the real
+gipyf and gifviewer code:
+
+    parse     GiPyF.parse throughput
+    cache     cache size and build time for each frame cache encoding
+    decode    per-frame read and decode time for each encoding
+    playback  show_gif_frames on the fake clock: I2C bytes and transactions
+              per frame, and whether the display RAM matched the buffer after
+              every show()
+
+With a baseline, any time that got more than --tolerance slower and any
+size or byte count that grew is reported, and the exit status is 1.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import hostenv
+import gifgen
+import gipyf
+import machine
+import ssd1306
+import utime
+import gifviewer
+from bench_playback import ENCODINGS, build_cache, time_playback
+
+class FrameLimit(Exception):
+    pass
+
+
+class CountingScheduler(gifviewer.FrameScheduler):
+    """
+    FrameScheduler that ends playback after a number of frames
+    """
+
+    def __init__(self, frames):
+        super().__init__(gifviewer.SCHEDULE_CATCH_UP)
+        self.frames = frames
+
+    def wait(self, frame_delay):
+        if self.count >= self.frames:
+            raise FrameLimit()
+        return super().wait(frame_delay)
+
+
+def generated(directory):
+    """
+        Write the generated GIFs, all 64x128 like fuzzy.gif
+    :return: list of paths
+    """
+    random.seed(1)
+    paths = []
+
+    # a small sprite moving over a still background
+    frames = [(0, 0, 64, 128, [0] * (64 * 128), 10)]
+    for i in range(60):
+        x, y = (i * 3) % 48, (i * 7) % 112
+        frames.append((x, y, 16, 16, [(i + n) & 1 for n in range(16 * 16)], 5))
+    paths.append(('sprite_60', frames))
+
+    # full frame noise, nothing repeats
+    paths.append(('noise_16', [(0, 0, 64, 128, [random.getrandbits(1) for _ in range(64 * 128)], 10)
+                               for _ in range(16)]))
+
+    # horizontal stripes scrolling, compresses well
+    frames = []
+    for i in range(32):
+        frames.append((0, 0, 64, 128, [((y + i) >> 2) & 1 for y in range(128) for x in range(64)], 4))
+    paths.append(('stripes_32', frames))
+
+    result = []
+    for name, frames in paths:
+        path = os.path.join(directory, name + '.gif')
+        gifgen.write_gif(path, 64, 128, frames)
+        result.append(path)
+    return result
+
+
+def bench_parse(gif_path, repeat):
+    best = None
+    for _ in range(repeat):
+        gif = gipyf.GiPyF()
+        start = time.perf_counter()
+        gif.parse(gif_path, lambda number, image: None, lambda alpha, delay: None)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    size = os.path.getsize(gif_path)
+    return {
+        'frames': gif.frames_count,
+        'image_map_entries': gif.image_map.get_size(),
+        'seconds': best,
+        'ms_per_frame': 1000 * best / gif.frames_count,
+        'kb_per_second': size / 1024 / best,
+    }
+
+
+def bench_cache_and_decode(gif_path, oled):
+    results = {}
+    for label, encoding, objective in ENCODINGS:
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            cache_dir, image_name = build_cache(directory, gif_path, encoding, objective)
+            build = time.perf_counter() - start
+            oled.fill(0)
+            timings, screens, cache_size, draw_calls = time_playback(cache_dir, image_name, oled, 3)
+        timings.sort()
+        results[label] = {
+            'cache_bytes': cache_size,
+            'build_seconds': build,
+            'decode_mean_ms': 1000 * sum(timings) / len(timings),
+            'decode_p95_ms': 1000 * timings[(len(timings) * 95 - 1) // 100],
+            'decode_max_ms': 1000 * timings[-1],
+            'draw_calls_per_frame': draw_calls,
+        }
+    return results
+
+
+def bench_playback(gif_path, loops):
+    with tempfile.TemporaryDirectory() as directory:
+        cache_dir, image_name = build_cache(directory, gif_path, gifviewer.ENCODING_DELTA)
+        pack = gifviewer.open_cache(cache_dir, image_name)
+        frame_count = pack.frame_count
+
+        i2c = machine.I2C()
+        oled = ssd1306.SSD1306_I2C(gifviewer.DISPLAY_WIDTH, gifviewer.DISPLAY_HEIGHT, i2c)
+        gifviewer._oled = oled
+        screen = gifviewer.display_screen(oled)
+        mismatches = []
+        show = oled.show
+
+        def checked_show(region=None):
+            show(region)
+            if i2c.gram != screen:
+                mismatches.append(scheduler.count)
+
+        oled.show = checked_show
+        i2c.reset_counts()
+        frames = frame_count * loops
+        scheduler = CountingScheduler(frames)
+        utime.use_fake_clock()
+        start = time.perf_counter()
+        try:
+            gifviewer.show_gif_frames(pack, frame_cache=gifviewer.FrameCache(gifviewer.DEFAULT_FRAME_CACHE_BUDGET),
+                                      scheduler=scheduler)
+        except FrameLimit:
+            pass
+        finally:
+            elapsed = time.perf_counter() - start
+            utime.use_real_clock()
+            pack.close()
+    return {
+        'frames': frames,
+        'i2c_bytes_per_frame': i2c.bytes / frames,
+        'i2c_transactions_per_frame': i2c.transactions / frames,
+        'display_bytes_per_frame': i2c.data_bytes / frames,
+        'host_ms_per_frame': 1000 * elapsed / frames,
+        'display_matches': not mismatches,
+    }
+
+
+def run(gif_paths, repeat, loops):
+    results = {
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'gifs': {},
+    }
+    oled = ssd1306.SSD1306_I2C(gifviewer.DISPLAY_WIDTH, gifviewer.DISPLAY_HEIGHT, machine.I2C())
+    gifviewer._oled = oled
+    for gif_path in gif_paths:
+        name = os.path.splitext(os.path.basename(gif_path))[0]
+        print('benchmarking', name, file=sys.stderr)
+        results['gifs'][name] = {
+            'gif_bytes': os.path.getsize(gif_path),
+            'parse': bench_parse(gif_path, repeat),
+            'encodings': bench_cache_and_decode(gif_path, oled),
+            'playback': bench_playback(gif_path, loops),
+        }
+    return results
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """
+        List the measurements that got worse than the baseline
+    :param tolerance: fraction times may grow by, timings on a workstation are noisy
+    :return: list of messages
+    """
+    new = flatten(results['gifs'])
+    old = flatten(baseline['gifs'])
+    worse = []
+    for key, value in sorted(new.items()):
+        if key not in old or isinstance(value, str):
+            continue
+        before = old[key]
+        if isinstance(value, bool):
+            if before and not value:
+                worse.append('%s: was %s, now %s' % (key, before, value))
+            continue
+        if key.endswith('_max_ms'):
+            # a single slow sample, too noisy to compare
+            continue
+        timing = key.endswith(('seconds', '_ms', 'ms_per_frame'))
+        if key.endswith('per_second'):
+            if value < before * (1 - tolerance):
+                worse.append('%s: %.4g -> %.4g' % (key, before, value))
+        elif timing:
+            if value > before * (1 + tolerance):
+                worse.append('%s: %.4g -> %.4g' % (key, before, value))
+        elif value > before:
+            worse.append('%s: %s -> %s' % (key, before, value))
+    return worse
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('gifs', nargs='*', help='GIF files, defaults to fuzzy.gif')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('-b', '--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown, default 0.5')
+    parser.add_argument('--repeat', type=int, default=3, help='parse runs, the fastest counts')
+    parser.add_argument('--loops', type=int, default=3, help='loops of playback')
+    parser.add_argument('--no-generated', action='store_true', help='skip the generated GIFs')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        gif_paths = args.gifs or [os.path.join(hostenv.REPO_DIR, 'fuzzy.gif')]
+        if not args.no_generated:
+            gif_paths = gif_paths + generated(directory)
+        # keep the progress the device code prints out of the JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run(gif_paths, args.repeat, args.loops)
+    finally:
+        shutil.rmtree(directory)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    status = 0
+    for name, gif in results['gifs'].items():
+        if not gif['playback']['display_matches']:
+            print('%s: display RAM does not match the frame buffer' % name, file=sys.stderr)
+            status = 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            worse = compare(results, json.load(f), args.tolerance)
+        for message in worse:
+            print('worse than baseline:', message, file=sys.stderr)
+        if worse:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,175 @@
+"""
+Compares LZW code extraction speed: gipyf.BitReader against the old
+byte_to_bits string path that unpack_binary_data used before
+
+    python3 host/bench_bitreader.py [file.gif ...]
+
+Without arguments it runs fuzzy.gif and a few generated GIFs.
+"""
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+import hostenv
+import gifgen
+from gipyf import BitReader, byte_to_bits
+
+
+def lzw_frames(path):
+    """
+        Return (lzw_min_code_size, image_data) for every frame in a GIF
+    """
+    frames = []
+    with open(path, 'rb') as f:
+        f.read(10)
+        flags = f.read(1)[0]
+        f.read(2)
+        if flags & 0x80:
+            f.read(3 * (2 << (flags & 0x07)))
+        marker = f.read(1)
+        while marker and marker != b'\x3b':
+            if marker == b'\x21':
+                f.read(1)
+                length = f.read(1)[0]
+                while length:
+                    f.read(length)
+                    length = f.read(1)[0]
+            elif marker == b'\x2c':
+                f.read(8)
+                if f.read(1)[0] & 0x80:
+                    raise ValueError('local color tables are not supported')
+                min_code_size = f.read(1)[0]
+                data = b''
+                length = f.read(1)[0]
+                while length:
+                    data += f.read(length)
+                    length = f.read(1)[0]
+                frames.append((min_code_size, data))
+            marker = f.read(1)
+    return frames
+
+
+def read_codes(data, min_code_size, next_code):
+    """
+        Drive a code reader with the same width schedule as unpack_binary_data
+    :param next_code: function(width) returning the next code or -1
+    """
+    clear_code = 1 << min_code_size
+    codes = []
+    size = clear_code + 2
+    width = min_code_size + 1
+    first = True
+    while True:
+        if size >= (1 << width) and width < 12:
+            width += 1
+        code = next_code(width)
+        if code < 0:
+            break
+        codes.append(code)
+        if code == clear_code + 1:
+            break
+        if code == clear_code:
+            size = clear_code + 2
+            width = min_code_size + 1
+            first = True
+        elif first:
+            first = False
+        elif size < 4096:
+            size += 1
+    return codes
+
+
+def legacy_reader(data):
+    """
+        The string based code extraction removed from unpack_binary_data
+    """
+    state = {'pos': 7, 'dataByte': 0, 'cByte': byte_to_bits(data[0:1])}
+
+    def next_code(width):
+        pos = state['pos']
+        dataByte = state['dataByte']
+        cByte = state['cByte']
+        if dataByte >= len(data) - 1:
+            return -1
+        readbits_result = []
+        for k in range(width):
+            readbits_result.insert(0, cByte[pos])
+            pos -= 1
+            if pos < 0:
+                pos = 7
+                dataByte += 1
+                if len(data) - dataByte == 0:
+                    for ap in range(width - k):
+                        readbits_result.insert(0, 0)
+                    break
+                else:
+                    cByte = byte_to_bits(data[dataByte:dataByte + 1])
+        state['pos'] = pos
+        state['dataByte'] = dataByte
+        state['cByte'] = cByte
+        return int("".join([str(i) for i in readbits_result]), 2)
+
+    return next_code
+
+
+def bench(name, path, repeat):
+    frames = lzw_frames(path)
+    results = {}
+    for label, make_reader in (('legacy', legacy_reader), ('bitreader', lambda data: BitReader(data).read)):
+        codes = []
+        start = time.perf_counter()
+        for _ in range(repeat):
+            codes = []
+            for min_code_size, data in frames:
+                codes.append(read_codes(data, min_code_size, make_reader(data)))
+        elapsed = time.perf_counter() - start
+        count = sum(len(c) for c in codes) * repeat
+        results[label] = (codes, count / elapsed)
+
+    legacy_codes = results['legacy'][0]
+    new_codes = results['bitreader'][0]
+    # the legacy reader stops one byte early, so only compare what it saw
+    same = all(n[:len(l)] == l for l, n in zip(legacy_codes, new_codes))
+    print('%-24s %8d codes  legacy %10.0f codes/s  bitreader %10.0f codes/s  x%-5.1f %s' % (
+        name, sum(len(c) for c in new_codes), results['legacy'][1], results['bitreader'][1],
+        results['bitreader'][1] / results['legacy'][1], 'same codes' if same else 'CODES DIFFER'))
+    return same
+
+
+def synthetic(directory):
+    random.seed(0)
+    gifs = []
+
+    path = os.path.join(directory, 'noise_64x128.gif')
+    gifgen.write_gif(path, 64, 128, [(0, 0, 64, 128, [random.getrandbits(1) for _ in range(64 * 128)], 10)] * 4)
+    gifs.append(('noise 64x128 x4', path))
+
+    path = os.path.join(directory, 'noise_255x255.gif')
+    gifgen.write_gif(path, 255, 255, [(0, 0, 255, 255, [random.getrandbits(1) for _ in range(255 * 255)], 10)])
+    gifs.append(('noise 255x255', path))
+
+    path = os.path.join(directory, 'stripes_255x255.gif')
+    frames = []
+    for shift in range(8):
+        frames.append((0, 0, 255, 255, [((x + shift) >> 3) & 1 for y in range(255) for x in range(255)], 10))
+    gifs.append(('stripes 255x255 x8', path))
+    gifgen.write_gif(path, 255, 255, frames)
+    return gifs
+
+
+def main(argv):
+    gifs = [(os.path.basename(p), p) for p in argv]
+    with tempfile.TemporaryDirectory() as directory:
+        if not gifs:
+            gifs = [('fuzzy.gif', os.path.join(hostenv.REPO_DIR, 'fuzzy.gif'))] + synthetic(directory)
+        ok = True
+        for name, path in gifs:
+            ok = bench(name, path, 3 if os.path.getsize(path) < 20000 else 1) and ok
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,61 @@
+"""
+Peak heap used by GiPyF.parse with and without streaming image data
+
+    python3 host/bench_parse_memory.py [file.gif ...]
+
+Without arguments it generates a noise GIF whose single frame has more
+than 50 KB of LZW data.  Peaks are measured with tracemalloc.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import hostenv
+import gifgen
+import gipyf
+
+
+def lzw_bytes(path):
+    """
+        Total size of all image data sub-blocks in a GIF
+    """
+    from bench_bitreader import lzw_frames
+    return sum(len(data) for _, data in lzw_frames(path))
+
+
+def measure(path, streaming):
+    gif = gipyf.GiPyF()
+    tracemalloc.start()
+    start = time.perf_counter()
+    # image_data is dropped in the callback so only the parser itself is measured
+    gif.parse(path, lambda frame_number, image: image.image_data.clear(), lambda alpha, delay: None,
+              streaming=streaming)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed
+
+
+def main(argv):
+    with tempfile.TemporaryDirectory() as directory:
+        gifs = argv
+        if not gifs:
+            random.seed(0)
+            path = os.path.join(directory, 'noise_720x540.gif')
+            gifgen.write_gif(path, 720, 540, [(0, 0, 720, 540, [random.getrandbits(1) for _ in range(720 * 540)], 10)])
+            gifs = [path]
+        for path in gifs:
+            results = {}
+            for streaming in (False, True):
+                results[streaming] = measure(path, streaming)
+            print('%-20s %7d bytes of LZW data  peak heap: whole frame %8d  streaming %8d  saved %8d bytes' % (
+                os.path.basename(path), lzw_bytes(path), results[False][0], results[True][0],
+                results[False][0] - results[True][0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
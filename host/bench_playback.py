@@ -0,0 +1,102 @@
+"""
+Per-frame playback decode time and cache size for each frame cache encoding
+
+    python3 host/bench_playback.py [file.gif ...]
+
+Builds a cache for every encoding, then times reading each frame and
+drawing it into the display buffer (everything show_gif_frames does
+before _oled.show()) and counts the framebuf drawing calls per frame.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import hostenv
+import machine
+import ssd1306
+import gifcodec
+import gifviewer
+
+# label, encoding, builder objective
+ENCODINGS = (
+    ('map', gifviewer.ENCODING_MAP, gifviewer.OBJECTIVE_SIZE),
+    ('pages', gifviewer.ENCODING_PAGES, gifviewer.OBJECTIVE_SIZE),
+    ('delta', gifviewer.ENCODING_DELTA, gifviewer.OBJECTIVE_SIZE),
+    ('rle', gifviewer.ENCODING_RLE, gifviewer.OBJECTIVE_SIZE),
+    ('runs', gifviewer.ENCODING_RUNS, gifviewer.OBJECTIVE_SIZE),
+    ('auto-size', gifviewer.AUTO_ENCODINGS, gifviewer.OBJECTIVE_SIZE),
+    ('auto-speed', gifviewer.AUTO_ENCODINGS, gifviewer.OBJECTIVE_SPEED),
+)
+
+
+def build_cache(directory, gif_path, encoding, objective=gifviewer.OBJECTIVE_SIZE):
+    image_name = os.path.splitext(os.path.basename(gif_path))[0]
+    shutil.copy(gif_path, os.path.join(directory, image_name + '.gif'))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        cache_dir = 'cache_' + image_name
+        os.mkdir(cache_dir)
+        gifviewer.create_gif_image_files(cache_dir, image_name, encoding, objective=objective)
+    finally:
+        os.chdir(cwd)
+    return os.path.join(directory, cache_dir), image_name
+
+
+def time_playback(cache_dir, image_name, oled, loops):
+    pack = gifviewer.open_cache(cache_dir, image_name)
+    segments = gifcodec.MapSegments(pack.image_map(), pack)
+    fb = oled.framebuf
+    screen = gifviewer.display_screen(oled)
+    reader = gifviewer.FrameReader()
+    numbers = list(range(1, pack.frame_count + 1))
+    if pack.has_loop:
+        loop_numbers = [0] + numbers[1:]
+    else:
+        loop_numbers = numbers
+    timings = []
+    screens = []
+    calls = fb.calls
+    for loop in range(loops):
+        for number in loop_numbers if loop else numbers:
+            start = time.perf_counter()
+            pack.read_frame(reader, number, screen)
+            gifcodec.CODECS[reader.encoding].decode(reader, screen, fb, segments)
+            timings.append(time.perf_counter() - start)
+            if loop < 2:
+                screens.append(bytes(screen))
+    pack.close()
+    # the pack, or loose frames, loop frame, image map and its segments
+    cache_size = sum(os.path.getsize(os.path.join(cache_dir, n)) for n in os.listdir(cache_dir))
+    # framebuf pixel/hline/vline/fill_rect calls per frame
+    draw_calls = (fb.calls - calls) / len(timings)
+    return timings, screens, cache_size, draw_calls
+
+
+def main(argv):
+    gifs = argv or [os.path.join(hostenv.REPO_DIR, 'fuzzy.gif')]
+    gifviewer._oled = ssd1306.SSD1306_I2C(gifviewer.DISPLAY_WIDTH, gifviewer.DISPLAY_HEIGHT, machine.I2C())
+    ok = True
+    for gif_path in gifs:
+        reference = None
+        for label, encoding, objective in ENCODINGS:
+            with tempfile.TemporaryDirectory() as directory:
+                cache_dir, image_name = build_cache(directory, gif_path, encoding, objective)
+                gifviewer._oled.fill(0)
+                timings, screens, cache_size, draw_calls = time_playback(cache_dir, image_name, gifviewer._oled, 3)
+            if reference is None:
+                reference = screens
+            same = screens == reference
+            ok = ok and same
+            timings.sort()
+            print('%-14s %-10s %3d frames  cache %7d bytes  decode mean %7.3f ms  max %7.3f ms  %7.1f draws  %s' % (
+                os.path.basename(gif_path), label, len(screens) // 2, cache_size,
+                1000 * sum(timings) / len(timings), 1000 * timings[-1], draw_calls,
+                'same output' if same else 'OUTPUT DIFFERS'))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
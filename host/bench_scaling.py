@@ -0,0 +1,151 @@
+"""
+How parsing, cache size and playback scale with the GIF, on generated GIFs
+
+    python3 host/bench_scaling.py [-o results.csv] [--plot scaling.png] [parameter ...]
+
+Every parameter is swept on its own, the others stay at BASE:
+
+    frames         frame count
+    rect           side of the frames after the first, square
+    size           screen, WxH
+    colors         palette size
+    change         fraction of the rectangle's pixels changing per frame
+    min_code_size  LZW minimum code size
+    clear_every    LZW codes between clear codes, 0 for none
+
+For each GIF the CSV holds GiPyF.parse time, the default cache's size and
+the mean per-frame decode time and framebuf calls.  --plot draws one chart
+per parameter, it needs matplotlib.
+"""
+import argparse
+import contextlib
+import csv
+import os
+import sys
+import tempfile
+
+import hostenv
+import gifgen
+import machine
+import ssd1306
+import gifviewer
+from bench import bench_parse
+from bench_playback import build_cache, time_playback
+
+# options every GIF starts from, gifgen.write_synthetic's
+BASE = dict(width=64, height=128, frames=16, rect=(16, 16), colors=2, change=0.1)
+
+SWEEPS = {
+    'frames': [1, 4, 16, 64, 128],
+    'rect': [4, 8, 16, 32, 64],
+    'size': [(16, 32), (32, 64), (64, 64), (64, 128)],
+    'colors': [2, 4, 16, 256],
+    'change': [0.01, 0.05, 0.1, 0.5, 1.0],
+    'min_code_size': [2, 4, 8],
+    'clear_every': [0, 256, 64, 16, 4],
+}
+
+COLUMNS = ('parameter', 'value', 'gif_bytes', 'frames', 'parse_seconds', 'parse_ms_per_frame',
+           'cache_bytes', 'decode_mean_ms', 'draw_calls_per_frame')
+
+
+def options(parameter, value):
+    gif_options = dict(BASE)
+    if parameter == 'rect':
+        gif_options['rect'] = (value, value)
+    elif parameter == 'size':
+        gif_options['width'], gif_options['height'] = value
+    elif parameter == 'clear_every':
+        gif_options['clear_every'] = value or None
+    else:
+        gif_options[parameter] = value
+    return gif_options
+
+
+def measure(directory, parameter, value, repeat):
+    gif_path = gifgen.write_synthetic(os.path.join(directory, 'scaling.gif'), **options(parameter, value))
+    parse = bench_parse(gif_path, repeat)
+    with tempfile.TemporaryDirectory() as cache_root:
+        cache_dir, image_name = build_cache(cache_root, gif_path, gifviewer.AUTO_ENCODINGS)
+        gifviewer._oled.fill(0)
+        timings, screens, cache_size, draw_calls = time_playback(cache_dir, image_name, gifviewer._oled, 2)
+    return {
+        'parameter': parameter,
+        'value': 'x'.join(map(str, value)) if isinstance(value, tuple) else value,
+        'gif_bytes': os.path.getsize(gif_path),
+        'frames': parse['frames'],
+        'parse_seconds': parse['seconds'],
+        'parse_ms_per_frame': parse['ms_per_frame'],
+        'cache_bytes': cache_size,
+        'decode_mean_ms': 1000 * sum(timings) / len(timings),
+        'draw_calls_per_frame': draw_calls,
+    }
+
+
+def plot(rows, path):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('--plot needs matplotlib', file=sys.stderr)
+        return False
+    parameters = []
+    for row in rows:
+        if row['parameter'] not in parameters:
+            parameters.append(row['parameter'])
+    measures = ('parse_ms_per_frame', 'cache_bytes', 'decode_mean_ms')
+    figure, axes = plt.subplots(len(parameters), len(measures), squeeze=False,
+                                figsize=(4 * len(measures), 3 * len(parameters)))
+    for i, parameter in enumerate(parameters):
+        selected = [row for row in rows if row['parameter'] == parameter]
+        labels = [str(row['value']) for row in selected]
+        for j, key in enumerate(measures):
+            ax = axes[i][j]
+            ax.plot(range(len(selected)), [row[key] for row in selected], marker='o')
+            ax.set_xticks(range(len(selected)))
+            ax.set_xticklabels(labels)
+            ax.set_xlabel(parameter)
+            ax.set_ylabel(key)
+    figure.tight_layout()
+    figure.savefig(path)
+    return True
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('parameters', nargs='*', metavar='parameter',
+                        help='parameters to sweep, all by default: ' + ', '.join(sorted(SWEEPS)))
+    parser.add_argument('-o', '--output', help='write the CSV to this file')
+    parser.add_argument('--plot', help='draw the results to this image file')
+    parser.add_argument('--repeat', type=int, default=3, help='parse runs, the fastest counts')
+    args = parser.parse_args(argv)
+    for parameter in args.parameters:
+        if parameter not in SWEEPS:
+            parser.error('unknown parameter %s' % parameter)
+
+    gifviewer._oled = ssd1306.SSD1306_I2C(gifviewer.DISPLAY_WIDTH, gifviewer.DISPLAY_HEIGHT, machine.I2C())
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for parameter in args.parameters or list(SWEEPS):
+            for value in SWEEPS[parameter]:
+                print('%s = %s' % (parameter, value), file=sys.stderr)
+                # keep the progress the device code prints out of the CSV
+                with contextlib.redirect_stdout(sys.stderr):
+                    rows.append(measure(directory, parameter, value, args.repeat))
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.DictWriter(out, COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if args.output:
+            out.close()
+    if args.plot and not plot(rows, args.plot):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,273 @@
+"""
+Writes GIF files for the host benchmarks
+
+    python3 host/gifgen.py -o out_dir [--width 64] [--height 128] [--frames 16]
+                           [--rect 16x16] [--colors 2] [--change 0.1]
+                           [--min-code-size N] [--clear-every N] [--seed 1] name
+    python3 host/gifgen.py -o out_dir --corpus
+
+Only what gipyf needs: a global color table, one graphics control extension
+per frame and LZW compressed image blocks.  --corpus writes a fixed set of
+GIFs, the adversarial cases among them, see CORPUS.
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+
+
+def lzw_encode(pixels, min_code_size, clear_every=None):
+    """
+        LZW compress a sequence of palette indices
+    :param pixels: iterable of palette indices
+    :param min_code_size: GIF LZW minimum code size
+    :param clear_every: also send a clear code after this many codes, the
+        encoder only does when the table is full otherwise
+    :return: compressed bytes, not yet split into sub-blocks
+    """
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+
+    out = bytearray()
+    acc = 0
+    bits = 0
+
+    def emit(code, width):
+        nonlocal acc, bits
+        acc |= code << bits
+        bits += width
+        while bits >= 8:
+            out.append(acc & 0xff)
+            acc >>= 8
+            bits -= 8
+
+    width = min_code_size + 1
+    table = {}
+    next_code = end_code + 1
+    emit(clear_code, width)
+    codes = 0
+
+    prefix = None
+    for pixel in pixels:
+        if prefix is None:
+            prefix = pixel
+            continue
+        key = (prefix, pixel)
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        emit(prefix, width)
+        codes += 1
+        if clear_every and codes % clear_every == 0:
+            emit(clear_code, width)
+            table = {}
+            next_code = end_code + 1
+            width = min_code_size + 1
+        elif next_code < 4096:
+            table[key] = next_code
+            next_code += 1
+            if next_code > (1 << width) and width < 12:
+                width += 1
+        else:
+            # table full, start over
+            emit(clear_code, width)
+            table = {}
+            next_code = end_code + 1
+            width = min_code_size + 1
+        prefix = pixel
+
+    if prefix is not None:
+        emit(prefix, width)
+    emit(end_code, width)
+    if bits:
+        out.append(acc & 0xff)
+    return bytes(out)
+
+
+def sub_blocks(data):
+    out = bytearray()
+    for i in range(0, len(data), 255):
+        chunk = data[i:i + 255]
+        out.append(len(chunk))
+        out += chunk
+    out.append(0)
+    return bytes(out)
+
+
+def grey_palette(colors):
+    """
+        colors shades from black to white, rounded up to a power of two
+        entries as the global color table needs
+    """
+    size = 2
+    while size < colors:
+        size <<= 1
+    return tuple((v, v, v) for v in (255 * i // max(1, colors - 1) if i < colors else 0
+                                     for i in range(size)))
+
+
+def write_gif(path, width, height, frames, palette=((0, 0, 0), (255, 255, 255), (0, 0, 0), (0, 0, 0)),
+              min_code_size=None, clear_every=None):
+    """
+        Write a GIF89a file
+    :param path: output file name
+    :param width: screen width
+    :param height: screen height
+    :param frames: list of (x, y, w, h, pixels, delay) with delay in 1/100th second
+    :param palette: global color table, length must be a power of two
+    :param min_code_size: LZW minimum code size, at least what the palette
+        needs and at most 8; the smallest that fits when None
+    :param clear_every: see lzw_encode
+    :return:
+    """
+    size_bits = max(1, (len(palette) - 1).bit_length())
+    if min_code_size is None:
+        min_code_size = max(2, size_bits)
+    elif not max(2, size_bits) <= min_code_size <= 8:
+        raise ValueError("LZW minimum code size %d does not fit a %d color palette" % (min_code_size, len(palette)))
+
+    out = bytearray(b'GIF89a')
+    out += struct.pack('<HHBBB', width, height, 0x80 | ((size_bits - 1) << 4) | (size_bits - 1), 0, 0)
+    for r, g, b in palette:
+        out += bytes((r, g, b))
+
+    for x, y, w, h, pixels, delay in frames:
+        out += struct.pack('<BBBBHBB', 0x21, 0xf9, 4, 0, delay, 0, 0)
+        out += struct.pack('<BHHHHB', 0x2c, x, y, w, h, 0)
+        out.append(min_code_size)
+        out += sub_blocks(lzw_encode(pixels, min_code_size, clear_every))
+
+    out.append(0x3b)
+    with open(path, 'wb') as f:
+        f.write(out)
+
+
+def synthetic_frames(width, height, frames, rect=None, colors=2, change=0.1, seed=1, delay=5, block=8):
+    """
+        An animation of blocky artwork changing a little each frame
+    :param rect: (w, h) of every frame after the first, a random spot of the
+        screen; None redraws the whole screen
+    :param colors: palette indices used
+    :param change: fraction of the rectangle's pixels that change each frame
+    :param block: side of the squares the first frame is drawn with, 1 is noise
+    :return: frames for write_gif
+    """
+    rng = random.Random(seed)
+    blocks_across = (width + block - 1) // block
+    blocks = [rng.randrange(colors) for _ in range(blocks_across * ((height + block - 1) // block))]
+    canvas = [blocks[(y // block) * blocks_across + x // block] for y in range(height) for x in range(width)]
+    result = [(0, 0, width, height, list(canvas), delay)]
+    w, h = rect if rect else (width, height)
+    w = min(w, width)
+    h = min(h, height)
+    for _ in range(frames - 1):
+        x = rng.randrange(width - w + 1)
+        y = rng.randrange(height - h + 1)
+        for _ in range(int(w * h * change)):
+            index = (y + rng.randrange(h)) * width + x + rng.randrange(w)
+            # a different color, not just any color
+            canvas[index] = (canvas[index] + 1 + rng.randrange(max(1, colors - 1))) % colors
+        pixels = [canvas[(y + row) * width + x + column] for row in range(h) for column in range(w)]
+        result.append((x, y, w, h, pixels, delay))
+    return result
+
+
+def noise_frames(width, height, frames, colors=2, seed=1, delay=5):
+    """
+        Full screen noise, nothing repeats between or within frames
+    """
+    rng = random.Random(seed)
+    return [(0, 0, width, height, [rng.randrange(colors) for _ in range(width * height)], delay)
+            for _ in range(frames)]
+
+
+# name: generator options, write_gif options; all fit the 64x128 display
+CORPUS = {
+    # the usual case: blocky artwork, small parts changing
+    'art_16': (dict(frames=16, rect=(16, 16)), {}),
+    'art_64': (dict(frames=64, rect=(32, 32), change=0.05), {}),
+    'full_redraw_16': (dict(frames=16, change=0.3), {}),
+    # 256 colours of noise: the LZW table fills up, codes reach 12 bits and
+    # the encoder has to send clear codes
+    'noise_12bit': (dict(frames=4, colors=256, block=1), {}),
+    # two colours of noise, codes stay short but nothing compresses
+    'noise_2': (dict(frames=8, block=1), {}),
+    # a clear code every 8 codes, the table never grows
+    'frequent_clears': (dict(frames=8, block=1), dict(clear_every=8)),
+    # two colours sent with 9 bit codes from the start
+    'wide_codes': (dict(frames=8), dict(min_code_size=8)),
+    # many tiny frames at odd positions, not aligned to display pages
+    'tiny_rects': (dict(frames=128, rect=(3, 5), change=1.0), {}),
+    # one frame, nothing to animate
+    'still': (dict(frames=1), {}),
+}
+
+
+def write_synthetic(path, width=64, height=128, frames=16, rect=None, colors=2, change=0.1, seed=1,
+                    block=8, min_code_size=None, clear_every=None):
+    """
+        Generate and write one GIF, see synthetic_frames and write_gif
+    :return: path
+    """
+    if block == 1:
+        gif_frames = noise_frames(width, height, frames, colors, seed)
+    else:
+        gif_frames = synthetic_frames(width, height, frames, rect, colors, change, seed, block=block)
+    write_gif(path, width, height, gif_frames, grey_palette(colors), min_code_size, clear_every)
+    return path
+
+
+def write_corpus(directory, names=None):
+    """
+    :return: list of paths
+    """
+    paths = []
+    for name in names or sorted(CORPUS):
+        options, gif_options = CORPUS[name]
+        options = dict(options, **gif_options)
+        paths.append(write_synthetic(os.path.join(directory, name + '.gif'), **options))
+    return paths
+
+
+def parse_size(text):
+    w, _, h = text.partition('x')
+    return int(w), int(h or w)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('name', nargs='?', help='GIF to write, without .gif')
+    parser.add_argument('-o', '--out-dir', default='.', help='where the GIFs go')
+    parser.add_argument('--corpus', action='store_true', help='write the corpus: ' + ', '.join(sorted(CORPUS)))
+    parser.add_argument('--width', type=int, default=64)
+    parser.add_argument('--height', type=int, default=128)
+    parser.add_argument('--frames', type=int, default=16)
+    parser.add_argument('--rect', type=parse_size, help='WxH of the frames after the first, whole screen by default')
+    parser.add_argument('--colors', type=int, default=2, help='palette size, up to 256')
+    parser.add_argument('--change', type=float, default=0.1, help='fraction of pixels changing per frame')
+    parser.add_argument('--block', type=int, default=8, help='square size of the artwork, 1 for noise')
+    parser.add_argument('--min-code-size', type=int, help='LZW minimum code size, 2 to 8')
+    parser.add_argument('--clear-every', type=int, help='send an LZW clear code every N codes')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    if not args.corpus and not args.name:
+        parser.error('give a name or --corpus')
+    if not 2 <= args.colors <= 256:
+        parser.error('--colors must be 2 to 256')
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    if args.corpus:
+        paths = write_corpus(args.out_dir)
+    else:
+        paths = [write_synthetic(os.path.join(args.out_dir, args.name + '.gif'), args.width, args.height,
+                                 args.frames, args.rect, args.colors, args.change, args.seed, args.block,
+                                 args.min_code_size, args.clear_every)]
+    for path in paths:
+        print('%s: %d bytes' % (path, os.path.getsize(path)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,42 @@
+"""
+Lets the device modules (gipyf, gifviewer, ...) be imported under CPython
+
+Import this first from any script in this directory.
+"""
+import builtins
+import os
+import sys
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+STUBS_DIR = os.path.join(HOST_DIR, 'stubs')
+
+
+class _MicroPython:
+    """
+    Stand-in for the micropython module, the code emitters become no-ops
+    """
+
+    @staticmethod
+    def native(f):
+        return f
+
+    viper = native
+
+    @staticmethod
+    def const(value):
+        return value
+
+
+if not hasattr(builtins, 'micropython'):
+    builtins.micropython = _MicroPython()
+    builtins.const = _MicroPython.const
+
+# framebuf, machine and utime stand-ins
+if STUBS_DIR not in sys.path:
+    sys.path.insert(0, STUBS_DIR)
+
+# appended, not prepended: the repo ships MicroPython copies of stat/types/copy
+# that must not shadow the CPython standard library
+if REPO_DIR not in sys.path:
+    sys.path.append(REPO_DIR)
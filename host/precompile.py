@@ -0,0 +1,276 @@
+"""
+Build the frame cache of GIFs on a workstation
+
+    python3 host/precompile.py [-o out_dir] [-j jobs] [--encoding delta] file.gif ...
+
+Writes out_dir/cache_<name>/ for every file.gif, the same files
+gifviewer.run('<name>') writes on the device, using the same gipyf and
+gifviewer code.  Copy the directory to the board and run() starts straight
+in playback; the GIF itself does not have to be copied.
+
+Every cache is checked: its frames are played back twice, loop frame
+included, and each screen is compared with the GIF decoded by the plain LZW
+decoder below, which shares no code with gipyf.
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+import hostenv
+import framebuf
+import machine
+import ssd1306
+import gifcodec
+import gifviewer
+
+ENCODINGS = {
+    'map': gifviewer.ENCODING_MAP,
+    'pages': gifviewer.ENCODING_PAGES,
+    'delta': gifviewer.ENCODING_DELTA,
+    'rle': gifviewer.ENCODING_RLE,
+    'runs': gifviewer.ENCODING_RUNS,
+    'auto': gifviewer.AUTO_ENCODINGS,
+}
+
+
+def lzw_decode(data, min_code_size):
+    """
+        Decode GIF LZW data the textbook way, with a table of byte strings
+    :return: palette indices
+    """
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+    out = bytearray()
+    width = min_code_size + 1
+    table = None
+    previous = None
+    acc = 0
+    bits = 0
+    pos = 0
+    while True:
+        while bits < width and pos < len(data):
+            acc |= data[pos] << bits
+            bits += 8
+            pos += 1
+        if bits < width:
+            break
+        code = acc & ((1 << width) - 1)
+        acc >>= width
+        bits -= width
+        if code == clear_code:
+            table = [bytes((i,)) for i in range(clear_code)] + [b'', b'']
+            width = min_code_size + 1
+            previous = None
+            continue
+        if code == end_code:
+            break
+        if previous is None:
+            entry = table[code]
+        else:
+            if code < len(table):
+                entry = table[code]
+                new = previous + entry[:1]
+            elif code == len(table):
+                entry = new = previous + previous[:1]
+            else:
+                raise ValueError("invalid LZW code %d" % code)
+            if len(table) < 4096:
+                table.append(new)
+                if len(table) == 1 << width and width < 12:
+                    width += 1
+        out += entry
+        previous = entry
+    return out
+
+
+def check_fits(width, height):
+    """
+        The GIF is drawn rotated, its width across the display's 64 rows
+    """
+    if width > gifviewer.DISPLAY_HEIGHT or height > gifviewer.DISPLAY_WIDTH:
+        raise ValueError("%dx%d is larger than the %dx%d the display shows" % (
+            width, height, gifviewer.DISPLAY_HEIGHT, gifviewer.DISPLAY_WIDTH))
+
+
+def reference_screens(gif_path):
+    """
+        Decode a GIF and draw every frame the way the display shows it
+    :return: list of DISPLAY_BUFFER_SIZE byte strings, one per frame
+    """
+    with open(gif_path, 'rb') as f:
+        data = f.read()
+    width, height, flags = struct.unpack('<HHB', data[6:11])
+    check_fits(width, height)
+    pos = 13
+    if flags & 0x80:
+        pos += 3 << ((flags & 7) + 1)
+
+    pixels = bytearray(width * height)
+    screens = []
+    while data[pos] != 0x3b:
+        marker = data[pos]
+        pos += 1
+        if marker == 0x21:
+            pos += 1
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+        elif marker == 0x2c:
+            x, y, w, h, image_flags = struct.unpack('<HHHHB', data[pos:pos + 9])
+            pos += 9
+            if image_flags & 0x80:
+                pos += 3 << ((image_flags & 7) + 1)
+            min_code_size = data[pos]
+            pos += 1
+            compressed = bytearray()
+            while data[pos]:
+                compressed += data[pos + 1:pos + 1 + data[pos]]
+                pos += data[pos] + 1
+            pos += 1
+            indices = lzw_decode(compressed, min_code_size)
+            for i in range(min(len(indices), w * h)):
+                px = x + i % w
+                py = y + i // w
+                if px < width and py < height:
+                    pixels[py * width + px] = indices[i]
+            screen = bytearray(gifviewer.DISPLAY_BUFFER_SIZE)
+            for py in range(height):
+                for px in range(width):
+                    if pixels[py * width + px]:
+                        screen[(px >> 3) * gifviewer.DISPLAY_WIDTH + gifviewer.DISPLAY_WIDTH - 1 - py] |= 1 << (px & 7)
+            screens.append(bytes(screen))
+        else:
+            raise ValueError("unexpected block 0x%02x at %d" % (marker, pos - 1))
+    return screens
+
+
+def played_screens(cache_dir, image_name, loops=2):
+    """
+        Play a cache the way show_gif_frames does, without a display
+    :return: list of screens, frame_count * loops long
+    """
+    pack = gifviewer.open_cache(cache_dir, image_name)
+    segments = gifcodec.MapSegments(pack.image_map(), pack)
+    screen = bytearray(gifviewer.DISPLAY_BUFFER_SIZE)
+    fb = framebuf.FrameBuffer1(screen, gifviewer.DISPLAY_WIDTH, gifviewer.DISPLAY_HEIGHT)
+    reader = gifviewer.FrameReader()
+    screens = []
+    for loop in range(loops):
+        for index in range(1, pack.frame_count + 1):
+            pack.read_frame(reader, 0 if index == 1 and loop and pack.has_loop else index, screen)
+            gifcodec.CODECS[reader.encoding].decode(reader, screen, fb, segments)
+            screens.append(bytes(screen))
+    pack.close()
+    return screens
+
+
+def verify(gif_path, cache_dir, image_name):
+    """
+    :return: None when the cache plays the GIF, otherwise what is wrong
+    """
+    expected = reference_screens(gif_path)
+    played = played_screens(cache_dir, image_name)
+    if len(played) != 2 * len(expected):
+        return "%d frames cached, the GIF has %d" % (len(played) // 2, len(expected))
+    for index, screen in enumerate(played):
+        if screen != expected[index % len(expected)]:
+            return "frame %d (loop %d) differs from the GIF" % (index % len(expected) + 1, index // len(expected) + 1)
+    return None
+
+
+def compile_gif(job):
+    """
+        Build one cache, runs in a worker process
+    :param job: (gif_path, out_dir, encoding, check, force, build_options)
+    :return: (gif_path, error or None, frame count, cache bytes)
+    """
+    gif_path, out_dir, encoding, check, force, build_options = job
+    image_name = os.path.splitext(os.path.basename(gif_path))[0]
+    cache_name = 'cache_' + image_name
+    target = os.path.join(out_dir, cache_name)
+    if os.path.exists(target) and not force:
+        return gif_path, "%s exists, --force replaces it" % target, 0, 0
+
+    # the progress text frame_cb draws needs a display
+    gifviewer._oled = ssd1306.SSD1306_I2C(gifviewer.DISPLAY_WIDTH, gifviewer.DISPLAY_HEIGHT, machine.I2C())
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp()
+    try:
+        with open(gif_path, 'rb') as f:
+            header = f.read(10)
+        if header[:3] != b'GIF':
+            raise ValueError("not a GIF")
+        check_fits(*struct.unpack('<HH', header[6:10]))
+        shutil.copy(gif_path, os.path.join(directory, image_name + '.gif'))
+        os.chdir(directory)
+        os.mkdir(cache_name)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            gifviewer.create_gif_image_files(cache_name, image_name, encoding, **build_options)
+        os.chdir(cwd)
+        built = os.path.join(directory, cache_name)
+        pack = gifviewer.open_cache(built, image_name)
+        frames = pack.frame_count
+        pack.close()
+        size = sum(os.path.getsize(os.path.join(built, name)) for name in os.listdir(built))
+        if check:
+            error = verify(gif_path, built, image_name)
+            if error:
+                return gif_path, error, frames, size
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        shutil.move(built, target)
+        return gif_path, None, frames, size
+    except Exception as e:
+        return gif_path, "%s: %s" % (type(e).__name__, e), 0, 0
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('gifs', nargs='+', help='GIF files')
+    parser.add_argument('-o', '--out-dir', default='.', help='where the cache_<name> directories go')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='worker processes, defaults to one per CPU')
+    parser.add_argument('--encoding', choices=sorted(ENCODINGS), default='auto',
+                        help='frame cache encoding, auto picks one of pages, delta, rle and runs per frame')
+    parser.add_argument('--objective', choices=('size', 'speed'), default='size',
+                        help='what auto picks by: smallest or fastest to decode')
+    parser.add_argument('--map-entries', type=int, default=gifviewer.MAP_SEGMENT_ENTRIES,
+                        help='image map segment entries, map encoding only')
+    parser.add_argument('--map-bytes', type=int, default=gifviewer.MAP_SEGMENT_BYTES,
+                        help='image map segment bytes, map encoding only')
+    parser.add_argument('--map-full', choices=('segment', 'literal'), default='segment',
+                        help='when a frame does not fit the segment: start a new one, or store the frame as pages')
+    parser.add_argument('--no-verify', action='store_true', help='skip checking the cache against the GIF')
+    parser.add_argument('-f', '--force', action='store_true', help='replace existing caches')
+    args = parser.parse_args(argv)
+
+    out_dir = os.path.abspath(args.out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    build_options = {
+        'objective': gifviewer.OBJECTIVE_SIZE if args.objective == 'size' else gifviewer.OBJECTIVE_SPEED,
+        'map_entries': args.map_entries,
+        'map_bytes': args.map_bytes,
+        'map_full': gifviewer.MAP_FULL_NEW_SEGMENT if args.map_full == 'segment' else gifviewer.MAP_FULL_LITERAL,
+    }
+    jobs = [(os.path.abspath(path), out_dir, ENCODINGS[args.encoding], not args.no_verify, args.force, build_options)
+            for path in args.gifs]
+    failed = 0
+    with multiprocessing.Pool(max(1, min(args.jobs, len(jobs)))) as pool:
+        for gif_path, error, frames, size in pool.imap_unordered(compile_gif, jobs):
+            if error:
+                failed += 1
+                print('%s: FAILED, %s' % (gif_path, error), file=sys.stderr)
+            else:
+                print('%s: %d frames, %d bytes%s' % (gif_path, frames, size, '' if args.no_verify else ', verified'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,65 @@
+"""
+Pure Python stand-in for MicroPython's framebuf, MONO_VLSB only
+"""
+
+MONO_VLSB = 0
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format=MONO_VLSB):
+        self.buffer = buffer
+        self.width = width
+        self.height = height
+        # drawing calls, to compare how much work each frame encoding takes
+        self.calls = 0
+
+    def pixel(self, x, y, col=None):
+        self.calls += 1
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return None if col is not None else 0
+        index = (y >> 3) * self.width + x
+        bit = 1 << (y & 7)
+        if col is None:
+            return 1 if self.buffer[index] & bit else 0
+        if col:
+            self.buffer[index] |= bit
+        else:
+            self.buffer[index] &= ~bit
+
+    def fill(self, col):
+        value = 0xff if col else 0
+        for i in range(len(self.buffer)):
+            self.buffer[i] = value
+
+    def fill_rect(self, x, y, w, h, col):
+        self.calls += 1
+        x0 = max(x, 0)
+        x1 = min(x + w, self.width)
+        y1 = min(y + h, self.height)
+        y = max(y, 0)
+        while y < y1:
+            page_end = min((y | 7) + 1, y1)
+            mask = ((1 << (page_end - y)) - 1) << (y & 7)
+            start = (y >> 3) * self.width
+            for index in range(start + x0, start + x1):
+                if col:
+                    self.buffer[index] |= mask
+                else:
+                    self.buffer[index] &= ~mask
+            y = page_end
+
+    def hline(self, x, y, w, col):
+        self.fill_rect(x, y, w, 1, col)
+
+    def vline(self, x, y, h, col):
+        self.fill_rect(x, y, 1, h, col)
+
+    def text(self, string, x, y, col=1):
+        pass
+
+    def scroll(self, dx, dy):
+        raise NotImplementedError
+
+
+def FrameBuffer1(buffer, width, height):
+    return FrameBuffer(buffer, width, height, MONO_VLSB)
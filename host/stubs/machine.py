@@ -0,0 +1,105 @@
+"""
+Stand-in for MicroPython's machine module
+"""
+
+
+class Pin:
+    OUT = 1
+    IN = 0
+
+    def __init__(self, id, mode=None, value=None):
+        self.id = id
+        self._value = value or 0
+
+    def init(self, mode=None, value=None):
+        if value is not None:
+            self._value = value
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+    def high(self):
+        self._value = 1
+
+    def low(self):
+        self._value = 0
+
+
+class I2C:
+    """
+    Counts the bytes and transactions written, and keeps a model of an
+    SSD1306's display RAM (horizontal addressing mode) so what a driver
+    sent can be compared with its buffer
+    """
+
+    # commands followed by one argument byte
+    ONE_ARGUMENT = (0x20, 0x81, 0x8d, 0xa8, 0xd3, 0xd5, 0xd9, 0xda, 0xdb)
+
+    def __init__(self, id=0, scl=None, sda=None, freq=400000, width=128, pages=8):
+        self.width = width
+        self.pages = pages
+        self.gram = bytearray(width * pages)
+        self.reset_counts()
+        self.command = []
+        self.column_range = (0, width - 1)
+        self.page_range = (0, pages - 1)
+        self.column = 0
+        self.page = 0
+
+    def reset_counts(self):
+        self.bytes = 0
+        self.transactions = 0
+        self.data_bytes = 0
+
+    def writeto(self, addr, buf):
+        buf = bytes(buf)
+        self.bytes += len(buf)
+        self.transactions += 1
+        if not buf:
+            return 0
+        if buf[0] == 0x80:
+            self._command(buf[1])
+        elif buf[0] == 0x40:
+            self.data_bytes += len(buf) - 1
+            self._data(buf[1:])
+        return len(buf)
+
+    def _command(self, byte):
+        command = self.command
+        command.append(byte)
+        first = command[0]
+        if first in (0x21, 0x22):
+            if len(command) == 3:
+                if first == 0x21:
+                    self.column_range = (command[1], command[2])
+                    self.column = command[1]
+                else:
+                    self.page_range = (command[1], command[2])
+                    self.page = command[1]
+                self.command = []
+        elif first not in self.ONE_ARGUMENT or len(command) == 2:
+            self.command = []
+
+    def _data(self, data):
+        gram = self.gram
+        width = self.width
+        first_column, last_column = self.column_range
+        first_page, last_page = self.page_range
+        column = self.column
+        page = self.page
+        for byte in data:
+            gram[page * width + column] = byte
+            column += 1
+            if column > last_column:
+                column = first_column
+                page += 1
+                if page > last_page:
+                    page = first_page
+        self.column = column
+        self.page = page
+
+
+def reset():
+    raise SystemExit("machine.reset()")
@@ -0,0 +1,63 @@
+"""
+Stand-in for MicroPython's utime module
+
+Uses the workstation's monotonic clock until use_fake_clock() is called,
+after which time only moves when the code sleeps or advance() is called, so
+playback can be run as fast as the host allows with repeatable timing.
+"""
+import time
+
+# microseconds, None while the real clock is used
+_fake_us = None
+
+
+def use_fake_clock(start_ms=0):
+    global _fake_us
+    _fake_us = start_ms * 1000
+
+
+def use_real_clock():
+    global _fake_us
+    _fake_us = None
+
+
+def advance(us):
+    """
+        Move the fake clock forward, a no-op on the real clock
+    """
+    global _fake_us
+    if _fake_us is not None:
+        _fake_us += int(us)
+
+
+def ticks_us():
+    if _fake_us is not None:
+        return _fake_us
+    return int(time.monotonic() * 1000000)
+
+
+def ticks_ms():
+    return ticks_us() // 1000
+
+
+def ticks_diff(a, b):
+    return a - b
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def sleep_us(us):
+    if _fake_us is not None:
+        advance(us)
+    else:
+        time.sleep(us / 1000000)
+
+
+def sleep_ms(ms):
+    sleep_us(ms * 1000)
+
+
+def sleep(seconds):
+    sleep_us(seconds * 1000000)
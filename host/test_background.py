@@ -0,0 +1,108 @@
+"""
+Background decoding on a second thread, run with pytest from outside the
+repo:
+
+    cd /tmp && python3 -m pytest /path/to/repo/host
+"""
+import _thread
+import os
+import time
+
+import pytest
+
+import hostenv
+import machine
+import ssd1306
+import utime
+import gifviewer
+import background
+from bench import CountingScheduler
+from bench import FrameLimit
+from bench_playback import build_cache
+
+FUZZY = os.path.join(hostenv.REPO_DIR, 'fuzzy.gif')
+
+
+def wait_for_threads(count, timeout=5):
+    """
+    :return: whether only count threads started with _thread are left
+    """
+    end = time.monotonic() + timeout
+    while _thread._count() > count:
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def oled():
+    i2c = machine.I2C()
+    display = ssd1306.SSD1306_I2C(gifviewer.DISPLAY_WIDTH, gifviewer.DISPLAY_HEIGHT, i2c)
+    gifviewer._oled = display
+    return display
+
+
+@pytest.mark.parametrize('encoding', [gifviewer.ENCODING_DELTA, gifviewer.AUTO_ENCODINGS])
+def test_background_playback_matches_display(tmp_path, oled, encoding):
+    cache_dir, image_name = build_cache(str(tmp_path), FUZZY, encoding)
+    pack = gifviewer.open_cache(cache_dir, image_name)
+    frames = 3 * pack.frame_count
+    i2c = oled.i2c
+    screen = gifviewer.display_screen(oled)
+    mismatches = []
+    show = oled.show
+
+    def checked_show(region=None):
+        show(region)
+        if i2c.gram != screen:
+            mismatches.append(scheduler.count)
+
+    oled.show = checked_show
+    scheduler = CountingScheduler(frames)
+    threads = _thread._count()
+    utime.use_fake_clock()
+    try:
+        with pytest.raises(FrameLimit):
+            gifviewer.show_gif_frames(pack, scheduler=scheduler, background=True)
+    finally:
+        utime.use_real_clock()
+        pack.close()
+    assert scheduler.count == frames
+    assert mismatches == []
+    assert wait_for_threads(threads)
+
+
+def test_stop_ends_worker(tmp_path, oled):
+    cache_dir, image_name = build_cache(str(tmp_path), FUZZY, gifviewer.ENCODING_DELTA)
+    pack = gifviewer.open_cache(cache_dir, image_name)
+    threads = _thread._count()
+    decoder = background.BackgroundDecoder(pack, gifviewer.display_screen(oled))
+    for _ in range(5):
+        decoder.next()
+    assert decoder.index == 5
+    decoder.stop()
+    assert wait_for_threads(threads)
+    pack.close()
+
+
+def test_stop_after_error_ends_worker(tmp_path, oled):
+    cache_dir, image_name = build_cache(str(tmp_path), FUZZY, gifviewer.ENCODING_DELTA)
+    pack = gifviewer.open_cache(cache_dir, image_name)
+    read_frame = pack.read_frame
+
+    def failing_read_frame(reader, frame_number, screen=None):
+        if frame_number == 4:
+            raise OSError("read error")
+        return read_frame(reader, frame_number, screen)
+
+    pack.read_frame = failing_read_frame
+    threads = _thread._count()
+    decoder = background.BackgroundDecoder(pack, gifviewer.display_screen(oled))
+    with pytest.raises(OSError):
+        for _ in range(10):
+            decoder.next()
+    assert decoder.index == 3
+    decoder.stop()
+    assert wait_for_threads(threads)
+    pack.close()
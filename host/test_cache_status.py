@@ -0,0 +1,72 @@
+"""
+cache_status on interrupted builds, run with pytest from outside the repo:
+
+    cd /tmp && python3 -m pytest /path/to/repo/host
+"""
+import os
+import shutil
+
+import pytest
+
+import hostenv
+import machine
+import ssd1306
+import gifcache
+import gifviewer
+
+FUZZY = os.path.join(hostenv.REPO_DIR, 'fuzzy.gif')
+CACHE_DIR = 'cache_fuzzy'
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    gifviewer._oled = ssd1306.SSD1306_I2C(gifviewer.DISPLAY_WIDTH, gifviewer.DISPLAY_HEIGHT, machine.I2C())
+    shutil.copy(FUZZY, str(tmp_path / 'fuzzy.gif'))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def build():
+    status, manifest = gifcache.prepare_cache(CACHE_DIR, 'fuzzy')
+    gifviewer.create_gif_image_files(CACHE_DIR, 'fuzzy', gifviewer.ENCODING_DELTA, manifest=manifest)
+
+
+def interrupted_while_writing_map(cache_dir, image_name, manifest):
+    f = open(gifcache.map_file_name(cache_dir, image_name), 'w')
+    f.write('[')
+    f.close()
+    raise KeyboardInterrupt()
+
+
+def test_built_cache_is_ready(workdir):
+    build()
+    status, manifest = gifcache.cache_status(CACHE_DIR, 'fuzzy')
+    assert status == gifcache.CACHE_READY
+    assert manifest['complete']
+    assert manifest['frames'] == 74
+
+
+def test_build_interrupted_writing_map_resumes(workdir, monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.setattr(gifviewer, 'finish_cache', interrupted_while_writing_map)
+        with pytest.raises(KeyboardInterrupt):
+            build()
+
+    status, manifest = gifcache.cache_status(CACHE_DIR, 'fuzzy')
+    assert status == gifcache.CACHE_PARTIAL
+    assert manifest['frames'] == 74
+    assert not manifest['complete']
+
+    build()
+    assert gifcache.cache_status(CACHE_DIR, 'fuzzy')[0] == gifcache.CACHE_READY
+    pack = gifcache.open_cache(CACHE_DIR, 'fuzzy')
+    assert pack.frame_count == 74
+    pack.close()
+
+
+def test_cache_without_manifest_that_does_not_pack_is_rebuilt(workdir):
+    os.mkdir(CACHE_DIR)
+    f = open(gifcache.map_file_name(CACHE_DIR, 'fuzzy'), 'w')
+    f.write('[')
+    f.close()
+    assert gifcache.cache_status(CACHE_DIR, 'fuzzy')[0] == gifcache.CACHE_STALE
@@ -0,0 +1,60 @@
+"""
+FrameCache during playback, run with pytest from outside the repo:
+
+    cd /tmp && python3 -m pytest /path/to/repo/host
+"""
+import os
+import tracemalloc
+
+import hostenv
+import machine
+import ssd1306
+import gifviewer
+from bench_playback import build_cache
+
+FUZZY = os.path.join(hostenv.REPO_DIR, 'fuzzy.gif')
+
+
+def decoder(tmp_path, encoding, budget):
+    gifviewer._oled = ssd1306.SSD1306_I2C(gifviewer.DISPLAY_WIDTH, gifviewer.DISPLAY_HEIGHT, machine.I2C())
+    cache_dir, image_name = build_cache(str(tmp_path), FUZZY, encoding)
+    pack = gifviewer.open_cache(cache_dir, image_name)
+    oled = gifviewer._oled
+    return gifviewer.FrameDecoder(pack, gifviewer.display_screen(oled), oled.framebuf, gifviewer.FrameCache(budget))
+
+
+def test_loop_larger_than_budget_does_not_allocate(tmp_path):
+    # every frame a whole display, 10 of them fit
+    budget = 10 * (gifviewer.DISPLAY_BUFFER_SIZE + gifviewer.FrameCache.ENTRY_OVERHEAD)
+    frames = decoder(tmp_path, gifviewer.ENCODING_PAGES, budget)
+    for _ in range(frames.frame_count):
+        frames.next()
+    cache = frames.frame_cache
+    kept = dict(cache.entries)
+    assert len(kept) == 10
+
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        for _ in range(2 * frames.frame_count):
+            frames.next()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    frames.pack.close()
+
+    # a frame copy would be at least a display buffer
+    assert peak - start < gifviewer.DISPLAY_BUFFER_SIZE
+    assert cache.entries == kept
+    assert cache.hits == 2 * 10
+
+
+def test_loop_within_budget_only_reads_once(tmp_path):
+    frames = decoder(tmp_path, gifviewer.ENCODING_DELTA, gifviewer.DEFAULT_FRAME_CACHE_BUDGET)
+    for _ in range(3 * frames.frame_count):
+        frames.next()
+    cache = frames.frame_cache
+    frames.pack.close()
+    # the first loop, and frame 1 again through the loop frame
+    assert cache.misses == frames.frame_count + 1
+    assert cache.full == 0
@@ -0,0 +1,44 @@
+"""
+GiPyF.parse on damaged GIFs, run with pytest from outside the repo:
+
+    cd /tmp && python3 -m pytest /path/to/repo/host
+"""
+import os
+
+import pytest
+
+import hostenv
+import gipyf
+
+FUZZY = os.path.join(hostenv.REPO_DIR, 'fuzzy.gif')
+
+
+def truncated(tmp_path, length):
+    with open(FUZZY, 'rb') as f:
+        data = f.read(length)
+    path = tmp_path / 'truncated.gif'
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize('streaming', [True, False])
+@pytest.mark.parametrize('length', [3000, 800, 20])
+def test_truncated_gif_raises(tmp_path, streaming, length):
+    gif = gipyf.GiPyF()
+    with pytest.raises(ValueError):
+        gif.parse(truncated(tmp_path, length), lambda number, image: None, lambda alpha, delay: None,
+                  streaming=streaming, packed=True)
+
+
+def test_truncated_gif_raises_when_skipping(tmp_path):
+    gif = gipyf.GiPyF()
+    with pytest.raises(ValueError):
+        gif.parse(truncated(tmp_path, 3000), None, lambda alpha, delay: None, skip_frames=0xffffffff)
+
+
+def test_whole_gif_parses():
+    frames = []
+    gif = gipyf.GiPyF()
+    gif.parse(FUZZY, lambda number, image: frames.append(number), lambda alpha, delay: None, packed=True)
+    assert frames == list(range(1, gif.frames_count + 1))
+    assert gif.frames_count == 74
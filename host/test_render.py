@@ -0,0 +1,60 @@
+"""
+Drawing decoded frames into the display buffer, run with pytest from
+outside the repo:
+
+    cd /tmp && python3 -m pytest /path/to/repo/host
+"""
+import pytest
+
+import hostenv
+import framebuf
+import gipyf
+import gifviewer
+from gifgen import write_gif
+
+# (GIF width, height, frame rectangle): taller, wider, and both at an odd offset
+SIZES = [
+    (64, 136, (0, 0, 64, 136)),
+    (72, 128, (0, 0, 72, 128)),
+    (72, 136, (3, 5, 67, 131)),
+]
+
+
+def frame_pixels(w, h):
+    # the rows and columns off the display lit, to catch them wrapping onto it
+    return [1 if x >= 60 or y >= 124 or (x + y) % 3 == 0 else 0 for y in range(h) for x in range(w)]
+
+
+def reference(rect, pixels):
+    screen = bytearray(gifviewer.DISPLAY_BUFFER_SIZE)
+    fb = framebuf.FrameBuffer(screen, gifviewer.DISPLAY_WIDTH, gifviewer.DISPLAY_HEIGHT, framebuf.MONO_VLSB)
+    x0, y0, w, h = rect
+    for y in range(h):
+        for x in range(w):
+            fb.pixel(gifviewer.DISPLAY_WIDTH - 1 - (y0 + y), x0 + x, pixels[y * w + x])
+    return screen
+
+
+def rendered(path, packed):
+    screen = bytearray(gifviewer.DISPLAY_BUFFER_SIZE)
+    gif = gipyf.GiPyF()
+
+    def frame_cb(number, image):
+        if packed:
+            gifviewer.render_pixels(screen, image.pixels, image.width, image.height,
+                                    image.top_left_x, image.top_left_y)
+        else:
+            gifviewer.render_frame(screen, gif.image_map_list, image.image_data,
+                                   image.width, image.top_left_x, image.top_left_y)
+
+    gif.parse(path, frame_cb, lambda alpha, delay: None, packed=packed)
+    return screen
+
+
+@pytest.mark.parametrize('packed', [True, False])
+@pytest.mark.parametrize('width, height, rect', SIZES)
+def test_oversize_frame_is_clipped(tmp_path, packed, width, height, rect):
+    pixels = frame_pixels(rect[2], rect[3])
+    path = str(tmp_path / 'oversize.gif')
+    write_gif(path, width, height, [rect + (pixels, 10)])
+    assert rendered(path, packed) == reference(rect, pixels)
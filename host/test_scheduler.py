@@ -0,0 +1,135 @@
+"""
+FrameScheduler deadlines, late frame policies and lateness stats, run with
+pytest from outside the repo:
+
+    cd /tmp && python3 -m pytest /path/to/repo/host
+
+Time comes from the fake utime clock: it only moves when the scheduler
+sleeps or a test advances it to stand in for decoding.
+"""
+import os
+
+import pytest
+
+import hostenv
+import machine
+import ssd1306
+import utime
+import gifviewer
+from bench_playback import build_cache
+from gifgen import write_gif
+
+
+@pytest.fixture(autouse=True)
+def fake_clock():
+    utime.use_fake_clock()
+    yield
+    utime.use_real_clock()
+
+
+def play(scheduler, decode_ms, delay=10):
+    """
+        Wait for one frame per decode time, all with the same delay
+    :return: list of (shown, ms on the clock after the wait)
+    """
+    frames = []
+    for ms in decode_ms:
+        utime.advance(ms * 1000)
+        shown = scheduler.wait(delay)
+        frames.append((shown, utime.ticks_ms()))
+    return frames
+
+
+def test_on_time_frames_keep_absolute_deadlines():
+    scheduler = gifviewer.FrameScheduler()
+    frames = play(scheduler, [5, 20, 70, 99, 1])
+    assert frames == [(True, 5), (True, 105), (True, 205), (True, 305), (True, 405)]
+    assert scheduler.stats() == (5, 0, 0, 0, 0)
+
+
+def test_catch_up_shows_late_frame_and_keeps_deadlines():
+    scheduler = gifviewer.FrameScheduler(gifviewer.SCHEDULE_CATCH_UP)
+    frames = play(scheduler, [0, 250, 10, 10])
+    # frame 2 was due at 100, frame 3 at 200, frame 4 at 300
+    assert frames == [(True, 0), (True, 250), (True, 260), (True, 300)]
+    assert scheduler.stats() == (4, 210 / 4, 150, 150, 0)
+
+
+def test_drop_skips_frame_whose_successor_is_due():
+    scheduler = gifviewer.FrameScheduler(gifviewer.SCHEDULE_DROP)
+    frames = play(scheduler, [0, 250, 10, 10])
+    assert frames == [(True, 0), (False, 250), (True, 260), (True, 300)]
+    assert scheduler.skipped == 1
+    assert scheduler.stats()[4] == 1
+
+
+def test_drop_shows_frame_less_late_than_its_delay():
+    scheduler = gifviewer.FrameScheduler(gifviewer.SCHEDULE_DROP)
+    frames = play(scheduler, [0, 190, 10])
+    assert frames == [(True, 0), (True, 190), (True, 200)]
+    assert scheduler.skipped == 0
+
+
+def test_drop_never_skips_frames_without_delay():
+    scheduler = gifviewer.FrameScheduler(gifviewer.SCHEDULE_DROP)
+    assert [shown for shown, now in play(scheduler, [0, 500, 500], delay=0)] == [True, True, True]
+    assert scheduler.skipped == 0
+
+
+def test_resync_moves_later_deadlines_back():
+    scheduler = gifviewer.FrameScheduler(gifviewer.SCHEDULE_RESYNC)
+    frames = play(scheduler, [0, 250, 10, 10])
+    # frame 2 was 150 ms late, frame 3 is due a delay after it was shown
+    assert frames == [(True, 0), (True, 250), (True, 350), (True, 450)]
+    assert scheduler.stats() == (4, 150 / 4, 150, 150, 0)
+
+
+def test_sixteen_bit_delay():
+    scheduler = gifviewer.FrameScheduler()
+    # 0x012c, 3 seconds: the high byte set
+    frames = play(scheduler, [0, 0, 0], delay=0x012c)
+    assert frames == [(True, 0), (True, 3000), (True, 6000)]
+
+
+def test_sixteen_bit_delay_survives_the_cache(tmp_path):
+    gifviewer._oled = ssd1306.SSD1306_I2C(gifviewer.DISPLAY_WIDTH, gifviewer.DISPLAY_HEIGHT, machine.I2C())
+    os.mkdir(str(tmp_path / 'gifs'))
+    path = str(tmp_path / 'gifs' / 'slow.gif')
+    pixels = [(x + y) & 1 for y in range(128) for x in range(64)]
+    write_gif(path, 64, 128, [(0, 0, 64, 128, pixels, 0x012c), (0, 0, 64, 128, pixels[1:] + [0], 0x0203)])
+    cache_dir, image_name = build_cache(str(tmp_path), path, gifviewer.ENCODING_PAGES)
+    pack = gifviewer.open_cache(cache_dir, image_name)
+    oled = gifviewer._oled
+    decoder = gifviewer.FrameDecoder(pack, gifviewer.display_screen(oled), oled.framebuf)
+    delays = [decoder.next()[0] for _ in range(2)]
+    pack.close()
+    assert delays == [0x012c, 0x0203]
+
+
+def test_stats_mean_p95_max():
+    scheduler = gifviewer.FrameScheduler(gifviewer.SCHEDULE_RESYNC)
+    # with RESYNC every frame is as late as its decode time past the delay
+    late = list(range(0, 40, 2))
+    play(scheduler, [0] + [100 + ms for ms in late])
+    count, mean, p95, worst, skipped = scheduler.stats()
+    assert count == len(late) + 1
+    assert mean == sum(late) / count
+    assert p95 == sorted([0] + late)[(count * 95 - 1) // 100]
+    assert worst == max(late)
+    assert skipped == 0
+
+
+def test_p95_only_counts_recent_history():
+    scheduler = gifviewer.FrameScheduler(gifviewer.SCHEDULE_RESYNC)
+    # one very late frame, then more than HISTORY frames on time
+    play(scheduler, [0, 1100] + [100] * gifviewer.FrameScheduler.HISTORY)
+    count, mean, p95, worst, skipped = scheduler.stats()
+    assert p95 == 0
+    assert worst == 1000
+
+
+def test_reset_stats():
+    scheduler = gifviewer.FrameScheduler(gifviewer.SCHEDULE_DROP)
+    play(scheduler, [0, 250])
+    scheduler.reset_stats()
+    assert scheduler.stats() == (0, 0, 0, 0, 0)
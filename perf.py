@@ -0,0 +1,149 @@
+"""
+Per-phase timings of the parse and playback hot paths
+
+Nothing is recorded until enable() is called; the hot paths fetch recorder()
+once and only do `if prof is not None` checks per frame while it is off.
+Every phase keeps its last samples in a fixed-size ring buffer, so memory
+use does not grow however long the GIF plays.
+
+    import perf
+    perf.enable()
+    gifviewer.run('fuzzy')
+    ...
+    perf.recorder().dump_csv()
+"""
+import sys
+from array import array
+from utime import ticks_us, ticks_diff
+
+
+_recorder = None
+
+
+def enable(size=64):
+    """
+        Start recording, replacing any earlier recorder
+    :param size: samples kept per phase
+    :return: the Recorder
+    """
+    global _recorder
+    _recorder = Recorder(size)
+    return _recorder
+
+
+def disable():
+    global _recorder
+    _recorder = None
+
+
+def recorder():
+    """
+    :return: the active Recorder, None when recording is off
+    """
+    return _recorder
+
+
+def percentile(samples, count, percent=95):
+    """
+    :param samples: ring buffer the samples were added to
+    :param count: samples ever added, the ring holds the last len(samples)
+    :return: percentile of the samples still in the ring, count must not be 0
+    """
+    recent = sorted(samples[:min(count, len(samples))])
+    return recent[(len(recent) * percent - 1) // 100]
+
+
+class Phase:
+    """
+    Timings of one phase, in microseconds
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.samples = array('I', bytes(4 * size))
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, us):
+        if us < 0:
+            us = 0
+        samples = self.samples
+        samples[self.count % len(samples)] = us
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def recent(self):
+        """
+        :return: the samples still in the ring, oldest first
+        """
+        samples = self.samples
+        size = len(samples)
+        if self.count <= size:
+            return list(samples[:self.count])
+        start = self.count % size
+        return list(samples[start:]) + list(samples[:start])
+
+    def stats(self):
+        """
+        :return: (name, count, mean us, 95th percentile us, max us), the
+            percentile is over the samples still in the ring
+        """
+        if not self.count:
+            return self.name, 0, 0, 0, 0
+        return self.name, self.count, self.total // self.count, percentile(self.samples, self.count), self.max
+
+
+class Recorder:
+    def __init__(self, size=64):
+        self.size = size
+        self.phases = {}
+        # phase names in the order they were first seen
+        self.order = []
+
+    def add(self, name, us):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = Phase(name, self.size)
+            self.phases[name] = phase
+            self.order.append(name)
+        phase.add(us)
+
+    def lap(self, name, start):
+        """
+            Record the time since start against name
+        :param start: ticks_us() at the start of the phase
+        :return: ticks_us() now, the start of the next phase
+        """
+        now = ticks_us()
+        self.add(name, ticks_diff(now, start))
+        return now
+
+    def stats(self):
+        """
+        :return: list of Phase.stats() tuples
+        """
+        return [self.phases[name].stats() for name in self.order]
+
+    def dump_csv(self, out=None, samples=False):
+        """
+            Write the summary, and optionally every sample in the rings, as CSV
+        :param out: stream to write to, defaults to stdout (the serial console)
+        :param samples: also write phase,index,us rows, oldest first
+        :return:
+        """
+        if out is None:
+            out = sys.stdout
+        out.write("phase,count,mean_us,p95_us,max_us\n")
+        for row in self.stats():
+            out.write("%s,%d,%d,%d,%d\n" % row)
+        if samples:
+            out.write("phase,index,us\n")
+            for name in self.order:
+                phase = self.phases[name]
+                index = phase.count - min(phase.count, self.size)
+                for us in phase.recent():
+                    out.write("%s,%d,%d\n" % (name, index, us))
+                    index += 1
@@ -74,20 +74,36 @@ class SSD1306:
         self.write_cmd(SET_NORM_INV | (invert & 1))
 
     @micropython.native
-    def show(self):
-        x0 = 0
-        x1 = self.width - 1
+    def show(self, region=None):
+        # region is (x0, page0, x1, page1), inclusive, of the part of the
+        # buffer that changed since the last show(); None sends everything
+        if region is None:
+            x0 = 0
+            x1 = self.width - 1
+            page0 = 0
+            page1 = self.pages - 1
+        else:
+            x0, page0, x1, page1 = region
+        offset = 0
         if self.width == 64:
             # displays with width of 64 pixels are shifted by 32
-            x0 += 32
-            x1 += 32
+            offset = 32
         self.write_cmd(SET_COL_ADDR)
-        self.write_cmd(x0)
-        self.write_cmd(x1)
+        self.write_cmd(x0 + offset)
+        self.write_cmd(x1 + offset)
         self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
-        self.write_framebuf()
+        self.write_cmd(page0)
+        self.write_cmd(page1)
+        width = self.width
+        if region is None:
+            self.write_framebuf()
+        elif x0 == 0 and x1 == width - 1:
+            # whole pages are contiguous in the buffer
+            self.write_data(page0 * width, (page1 + 1) * width)
+        else:
+            # the display wraps to the next page at x1 by itself
+            for page in range(page0, page1 + 1):
+                self.write_data(page * width + x0, page * width + x1 + 1)
 
     @micropython.native
     def fill(self, col):
@@ -116,7 +132,8 @@ class SSD1306_I2C(SSD1306):
         # buffer).
         self.buffer = bytearray(((height // 8) * width) + 1)
         self.buffer[0] = 0x40  # Set first byte of data buffer to Co=0, D/C=1
-        self.framebuf = framebuf.FrameBuffer1(memoryview(self.buffer)[1:], width, height)
+        self.view = memoryview(self.buffer)
+        self.framebuf = framebuf.FrameBuffer1(self.view[1:], width, height)
         super().__init__(width, height, external_vcc)
 
     def write_cmd(self, cmd):
@@ -129,6 +146,16 @@ class SSD1306_I2C(SSD1306):
         # hardware I2C interfaces.
         self.i2c.writeto(self.addr, self.buffer)
 
+    def write_data(self, start, end):
+        # Send framebuffer bytes start to end, the byte just in front of them
+        # is borrowed for the Co=0, D/C=1 control byte so the transfer is
+        # still a single transaction without copying the data.
+        buffer = self.buffer
+        saved = buffer[start]
+        buffer[start] = 0x40
+        self.i2c.writeto(self.addr, self.view[start:end + 1])
+        buffer[start] = saved
+
     def poweron(self):
         pass
 
@@ -144,6 +171,7 @@ class SSD1306_SPI(SSD1306):
         self.res = res
         self.cs = cs
         self.buffer = bytearray((height // 8) * width)
+        self.view = memoryview(self.buffer)
         self.framebuf = framebuf.FrameBuffer1(self.buffer, width, height)
         super().__init__(width, height, external_vcc)
 
@@ -163,6 +191,14 @@ class SSD1306_SPI(SSD1306):
         self.spi.write(self.buffer)
         self.cs.high()
 
+    def write_data(self, start, end):
+        self.spi.init(baudrate=self.rate, polarity=0, phase=0)
+        self.cs.high()
+        self.dc.high()
+        self.cs.low()
+        self.spi.write(self.view[start:end])
+        self.cs.high()
+
     def poweron(self):
         self.res.high()
         time.sleep_ms(1)